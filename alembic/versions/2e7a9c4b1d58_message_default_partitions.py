@@ -0,0 +1,31 @@
+"""message default partitions
+
+Revision ID: 2e7a9c4b1d58
+Revises: 7b4e2c9d1a36
+Create Date: 2026-10-17 18:12:40.318527
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2e7a9c4b1d58'
+down_revision: Union[str, None] = '7b4e2c9d1a36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('messages', 'private_messages')
+
+
+def upgrade() -> None:
+    # Rows for a month without its own partition land here until partitions.py splits them out.
+    for table in TABLES:
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.execute(f"DROP TABLE {table}_default")
@@ -0,0 +1,38 @@
+"""chat history keyset indexes
+
+Revision ID: 3f1a9c2d7b64
+Revises: c70cbd565408
+Create Date: 2026-10-17 10:12:03.412871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a9c2d7b64'
+down_revision: Union[str, None] = 'c70cbd565408'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_messages_chat_id_created_at_id',
+        'messages',
+        ['chat_id', 'created_at', 'id'],
+        unique=False
+    )
+    op.create_index(
+        'ix_private_messages_chat_id_created_at_id',
+        'private_messages',
+        ['chat_id', 'created_at', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_private_messages_chat_id_created_at_id', table_name='private_messages')
+    op.drop_index('ix_messages_chat_id_created_at_id', table_name='messages')
@@ -0,0 +1,118 @@
+"""partition messages by month
+
+Revision ID: 5c9b3e1f7d48
+Revises: e41f6a8d2b05
+Create Date: 2026-10-17 13:41:07.925530
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c9b3e1f7d48'
+down_revision: Union[str, None] = 'e41f6a8d2b05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('messages', 'private_messages')
+# Partitions created ahead of the current month; partitions.py keeps extending them.
+PREMAKE_MONTHS = 2
+
+
+def add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    now = datetime.utcnow()
+
+    for table in TABLES:
+        op.execute(f"UPDATE {table} SET created_at = (now() AT TIME ZONE 'utc') WHERE created_at IS NULL")
+
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+        op.execute(f"ALTER TABLE {table}_unpartitioned RENAME CONSTRAINT {table}_pkey TO {table}_unpartitioned_pkey")
+        for index in (f'ix_{table}_id', f'ix_{table}_chat_id_created_at_id', f'ix_{table}_content_tsv'):
+            op.execute(f"ALTER INDEX {index} RENAME TO {index}_unpartitioned")
+
+        op.execute(f"""
+            CREATE TABLE {table} (
+                LIKE {table}_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED
+            ) PARTITION BY RANGE (created_at)
+        """)
+        op.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+        op.create_index(f'ix_{table}_id', table, ['id'], unique=False)
+        op.create_index(f'ix_{table}_chat_id_created_at_id', table, ['chat_id', 'created_at', 'id'], unique=False)
+        op.create_index(f'ix_{table}_content_tsv', table, ['content_tsv'], unique=False, postgresql_using='gin')
+
+        chat_table = 'chats' if table == 'messages' else 'private_chats'
+        op.create_foreign_key(f'{table}_chat_id_fkey', table, chat_table, ['chat_id'], ['id'])
+        op.create_foreign_key(f'{table}_sender_id_fkey', table, 'users', ['sender_id'], ['id'])
+
+        oldest = conn.execute(sa.text(f"SELECT MIN(created_at) FROM {table}_unpartitioned")).scalar() or now
+        month = datetime(oldest.year, oldest.month, 1)
+        last = add_months(datetime(now.year, now.month, 1), PREMAKE_MONTHS)
+        while month <= last:
+            op.execute(f"""
+                CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table}
+                FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')
+            """)
+            month = add_months(month, 1)
+
+        op.execute(f"""
+            INSERT INTO {table} (id, chat_id, sender_id, content, created_at)
+            SELECT id, chat_id, sender_id, content, created_at FROM {table}_unpartitioned
+        """)
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        op.execute(f"DROP TABLE {table}_unpartitioned")
+
+        op.execute(f"""
+            CREATE TABLE {table}_archive (
+                LIKE {table} INCLUDING GENERATED
+            ) PARTITION BY RANGE (created_at)
+        """)
+        op.execute(f"ALTER TABLE {table}_archive ADD PRIMARY KEY (id, created_at)")
+        op.create_index(
+            f'ix_{table}_archive_chat_id_created_at_id',
+            f'{table}_archive',
+            ['chat_id', 'created_at', 'id'],
+            unique=False
+        )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_partitioned")
+        op.execute(f"ALTER TABLE {table}_partitioned RENAME CONSTRAINT {table}_pkey TO {table}_partitioned_pkey")
+        for index in (f'ix_{table}_id', f'ix_{table}_chat_id_created_at_id', f'ix_{table}_content_tsv'):
+            op.execute(f"ALTER INDEX {index} RENAME TO {index}_partitioned")
+        op.execute(f"ALTER TABLE {table}_partitioned DROP CONSTRAINT {table}_chat_id_fkey")
+        op.execute(f"ALTER TABLE {table}_partitioned DROP CONSTRAINT {table}_sender_id_fkey")
+
+        op.execute(f"""
+            CREATE TABLE {table} (
+                LIKE {table}_partitioned INCLUDING DEFAULTS INCLUDING GENERATED
+            )
+        """)
+        op.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+        op.create_index(f'ix_{table}_id', table, ['id'], unique=False)
+        op.create_index(f'ix_{table}_chat_id_created_at_id', table, ['chat_id', 'created_at', 'id'], unique=False)
+        op.create_index(f'ix_{table}_content_tsv', table, ['content_tsv'], unique=False, postgresql_using='gin')
+
+        chat_table = 'chats' if table == 'messages' else 'private_chats'
+        op.create_foreign_key(f'{table}_chat_id_fkey', table, chat_table, ['chat_id'], ['id'])
+        op.create_foreign_key(f'{table}_sender_id_fkey', table, 'users', ['sender_id'], ['id'])
+
+        for source in (f'{table}_archive', f'{table}_partitioned'):
+            op.execute(f"""
+                INSERT INTO {table} (id, chat_id, sender_id, content, created_at)
+                SELECT id, chat_id, sender_id, content, created_at FROM {source}
+            """)
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        op.execute(f"DROP TABLE {table}_archive")
+        op.execute(f"DROP TABLE {table}_partitioned")
@@ -0,0 +1,121 @@
+"""hot lookup indexes
+
+Revision ID: 7b4e2c9d1a36
+Revises: f6b1d3a8c452
+Create Date: 2026-10-17 16:24:09.527831
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b4e2c9d1a36'
+down_revision: Union[str, None] = 'f6b1d3a8c452'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Merge duplicate group chats of a subject into the oldest one before it becomes unique.
+    op.execute("""
+        CREATE TEMPORARY TABLE chat_merges ON COMMIT DROP AS
+        SELECT id, MIN(id) OVER (PARTITION BY subject_id) AS keep_id
+        FROM chats
+        WHERE subject_id IS NOT NULL;
+    """)
+    for table in ('messages', 'messages_archive', 'chat_participants'):
+        op.execute(f"""
+            UPDATE {table} t
+            SET chat_id = m.keep_id
+            FROM chat_merges m
+            WHERE t.chat_id = m.id AND m.id <> m.keep_id;
+        """)
+    op.execute("""
+        DELETE FROM chats c
+        USING chat_merges m
+        WHERE c.id = m.id AND m.id <> m.keep_id;
+    """)
+
+    # Keep one participant row per user and chat, carrying over the furthest read cursor.
+    op.execute("""
+        WITH ranked AS (
+            SELECT id,
+                   MIN(id) OVER (PARTITION BY chat_id, user_id) AS keep_id,
+                   MAX(last_read_message_id) OVER (PARTITION BY chat_id, user_id) AS last_read
+            FROM chat_participants
+        )
+        UPDATE chat_participants cp
+        SET last_read_message_id = ranked.last_read
+        FROM ranked
+        WHERE cp.id = ranked.keep_id AND ranked.id = ranked.keep_id;
+    """)
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, MIN(id) OVER (PARTITION BY chat_id, user_id) AS keep_id
+            FROM chat_participants
+        )
+        DELETE FROM chat_participants cp
+        USING ranked
+        WHERE cp.id = ranked.id AND ranked.id <> ranked.keep_id;
+    """)
+
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, MIN(id) OVER (PARTITION BY student_id, subject_id) AS keep_id
+            FROM enrollments
+        )
+        DELETE FROM enrollments e
+        USING ranked
+        WHERE e.id = ranked.id AND ranked.id <> ranked.keep_id;
+    """)
+
+    # The newest submission wins; grades of the dropped ones move to it and are deduped below.
+    op.execute("""
+        CREATE TEMPORARY TABLE upload_merges ON COMMIT DROP AS
+        SELECT id, MAX(id) OVER (PARTITION BY task_id, student_id) AS keep_id
+        FROM task_uploads;
+    """)
+    op.execute("""
+        UPDATE grades g
+        SET task_upload_id = m.keep_id
+        FROM upload_merges m
+        WHERE g.task_upload_id = m.id AND m.id <> m.keep_id;
+    """)
+    op.execute("""
+        DELETE FROM task_uploads tu
+        USING upload_merges m
+        WHERE tu.id = m.id AND m.id <> m.keep_id;
+    """)
+
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, MAX(id) OVER (PARTITION BY task_upload_id) AS keep_id
+            FROM grades
+        )
+        DELETE FROM grades g
+        USING ranked
+        WHERE g.id = ranked.id AND ranked.id <> ranked.keep_id;
+    """)
+
+    op.create_unique_constraint('uq_chats_subject_id', 'chats', ['subject_id'])
+    op.create_unique_constraint('uq_chat_participants_chat_id_user_id', 'chat_participants', ['chat_id', 'user_id'])
+    op.create_unique_constraint('uq_enrollments_student_id_subject_id', 'enrollments', ['student_id', 'subject_id'])
+    op.create_unique_constraint('uq_task_uploads_task_id_student_id', 'task_uploads', ['task_id', 'student_id'])
+    op.create_unique_constraint('uq_grades_task_upload_id', 'grades', ['task_upload_id'])
+
+    # The unique constraints lead with the other column, so these lookups need their own index.
+    op.create_index('ix_enrollments_subject_id', 'enrollments', ['subject_id'], unique=False)
+    op.create_index('ix_tasks_subject_id_deadline', 'tasks', ['subject_id', 'deadline'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tasks_subject_id_deadline', table_name='tasks')
+    op.drop_index('ix_enrollments_subject_id', table_name='enrollments')
+    op.drop_constraint('uq_grades_task_upload_id', 'grades', type_='unique')
+    op.drop_constraint('uq_task_uploads_task_id_student_id', 'task_uploads', type_='unique')
+    op.drop_constraint('uq_enrollments_student_id_subject_id', 'enrollments', type_='unique')
+    op.drop_constraint('uq_chat_participants_chat_id_user_id', 'chat_participants', type_='unique')
+    op.drop_constraint('uq_chats_subject_id', 'chats', type_='unique')
@@ -0,0 +1,55 @@
+"""canonical private chat pairs
+
+Revision ID: 8d2e4b7a1c93
+Revises: 3f1a9c2d7b64
+Create Date: 2026-10-17 11:02:45.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4b7a1c93'
+down_revision: Union[str, None] = '3f1a9c2d7b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        UPDATE private_chats
+        SET user1_id = user2_id, user2_id = user1_id
+        WHERE user1_id > user2_id;
+    """)
+
+    # Merge duplicate conversations into the oldest row of each pair.
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, MIN(id) OVER (PARTITION BY user1_id, user2_id) AS keep_id
+            FROM private_chats
+        )
+        UPDATE private_messages pm
+        SET chat_id = ranked.keep_id
+        FROM ranked
+        WHERE pm.chat_id = ranked.id AND ranked.id <> ranked.keep_id;
+    """)
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, MIN(id) OVER (PARTITION BY user1_id, user2_id) AS keep_id
+            FROM private_chats
+        )
+        DELETE FROM private_chats pc
+        USING ranked
+        WHERE pc.id = ranked.id AND ranked.id <> ranked.keep_id;
+    """)
+
+    op.create_unique_constraint('uq_private_chats_user_pair', 'private_chats', ['user1_id', 'user2_id'])
+    op.create_check_constraint('ck_private_chats_canonical_order', 'private_chats', 'user1_id <= user2_id')
+
+
+def downgrade() -> None:
+    op.drop_constraint('ck_private_chats_canonical_order', 'private_chats', type_='check')
+    op.drop_constraint('uq_private_chats_user_pair', 'private_chats', type_='unique')
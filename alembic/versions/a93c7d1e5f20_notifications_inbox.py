@@ -0,0 +1,46 @@
+"""notifications inbox
+
+Revision ID: a93c7d1e5f20
+Revises: 5c9b3e1f7d48
+Create Date: 2026-10-17 14:22:51.310482
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a93c7d1e5f20'
+down_revision: Union[str, None] = '5c9b3e1f7d48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('notifications',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=True),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('read_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_notifications_user_id_id', 'notifications', ['user_id', 'id'], unique=False)
+    op.create_index(
+        'ix_notifications_user_id_unread',
+        'notifications',
+        ['user_id', 'id'],
+        unique=False,
+        postgresql_where=sa.text('read_at IS NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notifications_user_id_unread', table_name='notifications')
+    op.drop_index('ix_notifications_user_id_id', table_name='notifications')
+    op.drop_table('notifications')
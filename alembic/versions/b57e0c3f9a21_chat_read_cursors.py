@@ -0,0 +1,30 @@
+"""chat read cursors
+
+Revision ID: b57e0c3f9a21
+Revises: 8d2e4b7a1c93
+Create Date: 2026-10-17 11:48:19.604217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b57e0c3f9a21'
+down_revision: Union[str, None] = '8d2e4b7a1c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat_participants', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+    op.add_column('private_chats', sa.Column('user1_last_read_id', sa.Integer(), nullable=True))
+    op.add_column('private_chats', sa.Column('user2_last_read_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('private_chats', 'user2_last_read_id')
+    op.drop_column('private_chats', 'user1_last_read_id')
+    op.drop_column('chat_participants', 'last_read_message_id')
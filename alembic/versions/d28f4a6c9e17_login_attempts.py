@@ -0,0 +1,34 @@
+"""login attempts
+
+Revision ID: d28f4a6c9e17
+Revises: a93c7d1e5f20
+Create Date: 2026-10-17 15:06:33.184920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd28f4a6c9e17'
+down_revision: Union[str, None] = 'a93c7d1e5f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('login_attempts',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('attempted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    prefixes=['UNLOGGED']
+    )
+    op.create_index('ix_login_attempts_key_attempted_at', 'login_attempts', ['key', 'attempted_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_login_attempts_key_attempted_at', table_name='login_attempts')
+    op.drop_table('login_attempts')
@@ -0,0 +1,38 @@
+"""message full text search
+
+Revision ID: e41f6a8d2b05
+Revises: b57e0c3f9a21
+Create Date: 2026-10-17 12:30:52.771940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f6a8d2b05'
+down_revision: Union[str, None] = 'b57e0c3f9a21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MESSAGE_TSVECTOR = "to_tsvector('simple', coalesce(content, ''))"
+
+
+def upgrade() -> None:
+    for table in ('messages', 'private_messages'):
+        op.add_column(table, sa.Column(
+            'content_tsv',
+            postgresql.TSVECTOR(),
+            sa.Computed(MESSAGE_TSVECTOR, persisted=True),
+            nullable=True
+        ))
+        op.create_index(f'ix_{table}_content_tsv', table, ['content_tsv'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    for table in ('private_messages', 'messages'):
+        op.drop_index(f'ix_{table}_content_tsv', table_name=table)
+        op.drop_column(table, 'content_tsv')
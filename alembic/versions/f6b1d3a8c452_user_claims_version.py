@@ -0,0 +1,26 @@
+"""user claims version
+
+Revision ID: f6b1d3a8c452
+Revises: d28f4a6c9e17
+Create Date: 2026-10-17 15:38:12.540716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6b1d3a8c452'
+down_revision: Union[str, None] = 'd28f4a6c9e17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('claims_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'claims_version')
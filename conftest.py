@@ -0,0 +1,5 @@
+import os
+
+# database.py builds its engines from DATABASE_URL at import time. Unit tests never
+# connect through them, so a placeholder is enough when no database is configured.
+os.environ.setdefault("DATABASE_URL", os.getenv("TEST_DATABASE_URL", "postgresql://localhost/test"))
@@ -1,44 +1,166 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from contextvars import ContextVar
 import os
+from urllib.parse import parse_qs, urlsplit
 from dotenv import load_dotenv
 from models import Base
+from pool_monitor import InstrumentedPool, pool_monitor
 
 load_dotenv()
 
 base_url = os.getenv("DATABASE_URL").split("?")[0]
+# TLS for every connection (engines and the realtime broker), in libpq sslmode terms: taken from
+# ?sslmode= on DATABASE_URL, e.g. "disable" for a local or CI database. Verified TLS by default.
+DB_SSL_MODE = parse_qs(urlsplit(os.getenv("DATABASE_URL")).query).get("sslmode", ["verify-full"])[0]
 DATABASE_URL = base_url.replace("postgresql://", "postgresql+asyncpg://")
+# Optional replica for read-only routes; without it reads go to the primary.
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+if READ_DATABASE_URL:
+    READ_DATABASE_URL = READ_DATABASE_URL.split("?")[0].replace("postgresql://", "postgresql+asyncpg://")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "0") == "1"
+# After a commit, the client keeps reading from the primary for this long (via a cookie),
+# so a redirect straight after a write never sees replica lag.
+DB_READ_PIN_SECONDS = int(os.getenv("DB_READ_PIN_SECONDS", "5"))
+DB_READ_PIN_COOKIE = "db_pin"
+# Dev-only: create missing tables on startup. Alembic owns the schema everywhere else, and
+# tables created here would make a later "alembic upgrade" fail with "already exists".
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "0") == "1"
+
+
+def create_engine_for(url: str):
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_use_lifo=DB_POOL_USE_LIFO,
+        connect_args={"ssl": DB_SSL_MODE}
+    )
+
+
+engine = create_engine_for(DATABASE_URL)
+pool_monitor.attach(engine)
+
+read_engine = engine
+if READ_DATABASE_URL:
+    read_engine = create_engine_for(READ_DATABASE_URL)
+    pool_monitor.attach(read_engine, "replica")
+
+
+class PrimarySession(Session):
+    pass
 
-engine = create_async_engine(
-    DATABASE_URL,
-    connect_args={
-        "ssl": True,
-        "server_settings": {
-            "sslmode": "require"
-        }
-    }
-)
 
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
+    sync_session_class=PrimarySession,
+    expire_on_commit=False
+)
+
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
     expire_on_commit=False
 )
 
+# Per-request {"pinned": bool, "wrote": bool}; a mutable holder so a commit made in a copied
+# context (dependency, background task) is still seen by the middleware.
+read_pin: ContextVar[dict] = ContextVar("read_pin", default=None)
+
+
+@event.listens_for(PrimarySession, "after_commit")
+def _pin_reads_to_primary(session):
+    pin = read_pin.get()
+    if pin is not None:
+        pin["pinned"] = pin["wrote"] = True
+
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
-async def get_db():
-    async with AsyncSessionLocal() as session:
-        try:
-            yield session
-        finally:
+class LazySession:
+    # Stands in for an AsyncSession: the session is only opened on first use, and release()
+    # hands its pooled connection back as soon as the caller's DB work is done. Using it
+    # again afterwards simply opens a fresh session.
+    def __init__(self, factory):
+        self._factory = factory
+        self._session = None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._factory()
+        return getattr(self._session, name)
+
+    async def release(self):
+        session, self._session = self._session, None
+        if session is not None:
             await session.close()
 
 
+async def get_db():
+    session = LazySession(AsyncSessionLocal)
+    try:
+        yield session
+    finally:
+        await session.release()
+
+
+def read_session_factory():
+    # The replica, unless this client wrote something moments ago (the cookie) or earlier in
+    # this request. Called when the session is first used rather than when the dependency
+    # resolves, so a handler that commits through get_db and then reads sees its own write.
+    pin = read_pin.get()
+    if pin and (pin["pinned"] or pin["wrote"]):
+        return AsyncSessionLocal()
+    return ReadSessionLocal()
+
+
+async def get_read_db():
+    # For read-only routes.
+    session = LazySession(read_session_factory)
+    try:
+        yield session
+    finally:
+        await session.release()
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        cookie_header = b"; ".join(value for header, value in scope["headers"] if header == b"cookie")
+        pin = {"pinned": f"{DB_READ_PIN_COOKIE}=".encode() in cookie_header, "wrote": False}
+        read_pin.set(pin)
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and pin["wrote"]:
+                message = {**message, "headers": [
+                    *message.get("headers", []),
+                    (b"set-cookie", f"{DB_READ_PIN_COOKIE}=1; Max-Age={DB_READ_PIN_SECONDS}; Path=/; HttpOnly; SameSite=Lax".encode())
+                ]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
+
+
 async def recreate_database():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
@@ -5,23 +5,49 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from database import init_db, recreate_database
 from calendar_page import *
-from routes import auth, subjects, tasks, enrollments, notifications, chats, grades_statistic, users, calendar_page
+from routes import auth, subjects, tasks, enrollments, notifications, chats, grades_statistic, users, calendar_page, metrics
 from pathlib import Path
-from database import init_db
+from database import init_db, ReadYourWritesMiddleware, DB_CREATE_ALL
+from realtime import broker
+from message_writer import message_writer, read_cursors
+from routes.notifications import dispatcher, manager as notification_manager
+from partitions import run_maintenance, maintenance_loop
+from rate_limit import login_limiter
+from pool_monitor import pool_monitor, RouteTagMiddleware
 
 import asyncio
 
 
-app = FastAPI(debug=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-app.mount("/avatars", StaticFiles(directory="avatars"), name="avatars")
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
+    if DB_CREATE_ALL:
+        await init_db()
+    await run_maintenance()
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    await broker.start()
+    await message_writer.start()
+    await read_cursors.start()
+    await dispatcher.start()
+    await notification_manager.start()
+    await login_limiter.start()
+    await pool_monitor.start()
     yield
+    await pool_monitor.stop()
+    await login_limiter.stop()
+    await notification_manager.stop()
+    await dispatcher.stop()
+    await read_cursors.stop()
+    await message_writer.stop()
+    await broker.stop()
+    maintenance_task.cancel()
+
+
+app = FastAPI(debug=True, lifespan=lifespan)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(RouteTagMiddleware)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount("/avatars", StaticFiles(directory="avatars"), name="avatars")
 
 app.include_router(users.router)
 app.include_router(auth.router)
@@ -32,6 +58,7 @@ app.include_router(notifications.router)
 app.include_router(chats.router)
 app.include_router(calendar_page.router)
 app.include_router(grades_statistic.router)
+app.include_router(metrics.router)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+import os
+from typing import FrozenSet, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache, MISSING
+from models import Chat, Enrollment, Subject
+from realtime import broker
+
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "60"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+
+
+class SubjectMembers(NamedTuple):
+    teacher_id: int
+    student_ids: FrozenSet[int]
+
+    def includes(self, user_id: int) -> bool:
+        return user_id == self.teacher_id or user_id in self.student_ids
+
+
+subject_members_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+chat_subject_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+
+
+async def get_subject_members(db: AsyncSession, subject_id: int) -> Optional[SubjectMembers]:
+    members = subject_members_cache.get(subject_id)
+    if members is not None:
+        return members
+
+    result = await db.execute(
+        select(Subject.teacher_id, Enrollment.student_id)
+        .outerjoin(Enrollment, Enrollment.subject_id == Subject.id)
+        .filter(Subject.id == subject_id)
+    )
+    rows = result.all()
+    if not rows:
+        return None
+
+    members = SubjectMembers(
+        teacher_id=rows[0].teacher_id,
+        student_ids=frozenset(row.student_id for row in rows if row.student_id is not None)
+    )
+    subject_members_cache.set(subject_id, members)
+    return members
+
+
+async def get_chat_subject_id(db: AsyncSession, chat_id: int) -> Optional[int]:
+    subject_id = chat_subject_cache.get(chat_id, MISSING)
+    if subject_id is not MISSING:
+        return subject_id
+
+    result = await db.execute(select(Chat.subject_id).filter(Chat.id == chat_id))
+    subject_id = result.scalar_one_or_none()
+    if subject_id is not None:
+        chat_subject_cache.set(chat_id, subject_id)
+    return subject_id
+
+
+async def is_subject_member(db: AsyncSession, subject_id: int, user_id: int, claims=None) -> bool:
+    # Fresh token claims (security.get_token_claims) can confirm membership without a query;
+    # a negative answer is still checked against the database.
+    if claims is not None and claims.user_id == user_id and claims.is_member(subject_id):
+        return True
+    members = await get_subject_members(db, subject_id)
+    return members is not None and members.includes(user_id)
+
+
+async def is_subject_teacher(db: AsyncSession, subject_id: int, user_id: int, claims=None) -> bool:
+    if claims is not None and claims.user_id == user_id and claims.is_teacher(subject_id):
+        return True
+    members = await get_subject_members(db, subject_id)
+    return members is not None and members.teacher_id == user_id
+
+
+async def invalidate_subject(subject_id: int):
+    # Published so every worker drops its copy, not just the one that handled the change.
+    await broker.publish("membership", subject_id, "")
+
+
+async def _on_invalidate(subject_id: int, payload: str):
+    subject_members_cache.pop(subject_id)
+
+
+broker.subscribe("membership", _on_invalidate)
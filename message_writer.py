@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, Tuple
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.05"))
+# How long a sender waits for its batch to commit before the message is reported as not saved.
+MESSAGE_SUBMIT_TIMEOUT = float(os.getenv("MESSAGE_SUBMIT_TIMEOUT", "10"))
+READ_CURSOR_FLUSH_INTERVAL = float(os.getenv("READ_CURSOR_FLUSH_INTERVAL", "2"))
+
+
+class MessageWriter:
+    def __init__(self, batch_size: int = MESSAGE_BATCH_SIZE, flush_interval: float = MESSAGE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.queue.put_nowait(None)
+            await self.task
+            self.task = None
+
+    async def submit(self, model, values: dict, timeout: float = MESSAGE_SUBMIT_TIMEOUT) -> int:
+        # Resolves with the id the row was inserted under once its batch is committed.
+        if self.task is None or self.task.done():
+            raise RuntimeError("Message writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((model, values, future))
+        return await asyncio.wait_for(future, timeout)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        try:
+            results = await self._insert(batch)
+        except Exception as e:
+            # One bad row must not fail everyone else's messages: retry them one at a time
+            # so only the offending row is rejected.
+            logger.warning(f"Failed to persist {len(batch)} chat messages as a batch, retrying singly: {e}")
+            results = []
+            for item in batch:
+                try:
+                    results.extend(await self._insert([item]))
+                except Exception as e:
+                    logger.error(f"Failed to persist chat message: {e}")
+                    future = item[2]
+                    if not future.done():
+                        future.set_exception(e)
+
+        for message_id, future in results:
+            if not future.done():
+                future.set_result(message_id)
+
+    async def _insert(self, batch):
+        rows_by_model = defaultdict(list)
+        for model, values, future in batch:
+            rows_by_model[model].append((values, future))
+
+        results = []
+        async with AsyncSessionLocal() as session:
+            for model, rows in rows_by_model.items():
+                result = await session.execute(
+                    insert(model).returning(model.id, sort_by_parameter_order=True),
+                    [values for values, _ in rows]
+                )
+                results.extend(zip(result.scalars().all(), (future for _, future in rows)))
+            await session.commit()
+        return results
+
+
+class ReadCursorWriter:
+    def __init__(self, flush_interval: float = READ_CURSOR_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # (kind, chat_id, user_id) -> highest message id read since the last flush
+        self.pending: Dict[Tuple[str, int, int], int] = {}
+        self.task = None
+
+    def mark_read(self, kind: str, chat_id: int, user_id: int, message_id: int):
+        key = (kind, chat_id, user_id)
+        if message_id > self.pending.get(key, 0):
+            self.pending[key] = message_id
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+
+        try:
+            await self._write(pending)
+        except Exception as e:
+            logger.warning(f"Failed to update {len(pending)} read cursors as a batch, retrying singly: {e}")
+            await self._write_singly(pending)
+
+    async def _write_singly(self, pending):
+        entries = list(pending.items())
+        for index, (key, message_id) in enumerate(entries):
+            try:
+                await self._write({key: message_id})
+            except (OperationalError, InterfaceError) as e:
+                # The database is unreachable rather than the entry being bad: keep the rest.
+                logger.error(f"Failed to update read cursors, retrying on the next flush: {e}")
+                for (kind, chat_id, user_id), requeued_id in entries[index:]:
+                    self.mark_read(kind, chat_id, user_id, requeued_id)
+                return
+            except Exception as e:
+                logger.error(f"Dropping read cursor {key} at message {message_id}: {e}")
+
+    async def _write(self, pending):
+        group = [(chat_id, user_id, message_id) for (kind, chat_id, user_id), message_id in pending.items() if kind == "group"]
+        private = [(chat_id, user_id, message_id) for (kind, chat_id, user_id), message_id in pending.items() if kind == "private"]
+
+        async with AsyncSessionLocal() as session:
+            if group:
+                await session.execute(GROUP_READ_CURSOR_UPDATE, _unzip(group))
+            if private:
+                for statement in PRIVATE_READ_CURSOR_UPDATES:
+                    await session.execute(statement, _unzip(private))
+            await session.commit()
+
+
+def _unzip(rows):
+    chat_ids, user_ids, message_ids = zip(*rows)
+    return {"chat_ids": list(chat_ids), "user_ids": list(user_ids), "message_ids": list(message_ids)}
+
+
+GROUP_READ_CURSOR_UPDATE = text("""
+    UPDATE chat_participants cp
+    SET last_read_message_id = GREATEST(COALESCE(cp.last_read_message_id, 0), v.message_id)
+    FROM (
+        SELECT
+            unnest(CAST(:chat_ids AS INTEGER[])) AS chat_id,
+            unnest(CAST(:user_ids AS INTEGER[])) AS user_id,
+            unnest(CAST(:message_ids AS INTEGER[])) AS message_id
+    ) v
+    WHERE cp.chat_id = v.chat_id AND cp.user_id = v.user_id
+""")
+
+# One statement per side: each (chat, user) pair then matches at most one row per UPDATE.
+PRIVATE_READ_CURSOR_UPDATES = [
+    text(f"""
+        UPDATE private_chats pc
+        SET {side}_last_read_id = GREATEST(COALESCE(pc.{side}_last_read_id, 0), v.message_id)
+        FROM (
+            SELECT
+                unnest(CAST(:chat_ids AS INTEGER[])) AS chat_id,
+                unnest(CAST(:user_ids AS INTEGER[])) AS user_id,
+                unnest(CAST(:message_ids AS INTEGER[])) AS message_id
+        ) v
+        WHERE pc.id = v.chat_id AND pc.{side}_id = v.user_id
+    """)
+    for side in ("user1", "user2")
+]
+
+
+message_writer = MessageWriter()
+read_cursors = ReadCursorWriter()
@@ -0,0 +1,33 @@
+from collections import Counter, defaultdict
+from typing import Callable, Dict
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, Counter] = defaultdict(Counter)
+        self.gauges: Dict[str, Callable[[], object]] = {}
+
+    def increment(self, name: str, label: str = "total", amount: int = 1):
+        self.counters[name][label] += amount
+
+    def top(self, name: str, limit: int = 10):
+        return self.counters[name].most_common(limit)
+
+    def register_gauge(self, name: str, read: Callable[[], object]):
+        # Gauges are read lazily, e.g. cache sizes or queue depths.
+        self.gauges[name] = read
+
+    def snapshot(self, top_labels: int = 20):
+        return {
+            "counters": {
+                name: {
+                    "total": sum(counter.values()),
+                    "top": dict(counter.most_common(top_labels))
+                }
+                for name, counter in self.counters.items()
+            },
+            "gauges": {name: read() for name, read in self.gauges.items()}
+        }
+
+
+metrics = Metrics()
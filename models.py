@@ -1,10 +1,15 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Boolean, DateTime, ARRAY, CheckConstraint
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, BigInteger, Integer, String, Text, ForeignKey, Boolean, DateTime, ARRAY, CheckConstraint, Index, UniqueConstraint, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, declarative_base, deferred
 from datetime import datetime
 from sqlalchemy.sql import func
 
 Base = declarative_base()
 
+# Chats mix Ukrainian, Russian and English, so messages are indexed without stemming.
+SEARCH_CONFIG = "simple"
+MESSAGE_TSVECTOR = f"to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))"
+
 
 class User(Base):
     __tablename__ = "users"
@@ -16,6 +21,8 @@ class User(Base):
     avatar_url = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     is_active = Column(Boolean, default=True)
+    # Bumped whenever the user's roles change, invalidating role claims in older tokens.
+    claims_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     subjects_teaching = relationship("Subject", back_populates="teacher")
     enrollments = relationship("Enrollment", back_populates="student")
@@ -50,6 +57,10 @@ class Task(Base):
     subject = relationship("Subject", back_populates="tasks")
     uploads = relationship("TaskUpload", back_populates="task")
 
+    __table_args__ = (
+        Index("ix_tasks_subject_id_deadline", "subject_id", "deadline"),
+    )
+
 
 class Enrollment(Base):
     __tablename__ = "enrollments"
@@ -62,6 +73,11 @@ class Enrollment(Base):
     student = relationship("User", back_populates="enrollments")
     subject = relationship("Subject", back_populates="enrollments")
 
+    __table_args__ = (
+        UniqueConstraint("student_id", "subject_id", name="uq_enrollments_student_id_subject_id"),
+        Index("ix_enrollments_subject_id", "subject_id"),
+    )
+
 
 
 class Chat(Base):
@@ -77,6 +93,10 @@ class Chat(Base):
     messages = relationship("Message", back_populates="chat")
     participants = relationship("ChatParticipant", back_populates="chat")
 
+    __table_args__ = (
+        UniqueConstraint("subject_id", name="uq_chats_subject_id"),
+    )
+
 
 class ChatParticipant(Base):
     __tablename__ = "chat_participants"
@@ -84,21 +104,54 @@ class ChatParticipant(Base):
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
+    last_read_message_id = Column(Integer, nullable=True)
 
     chat = relationship("Chat", back_populates="participants")
 
+    __table_args__ = (
+        UniqueConstraint("chat_id", "user_id", name="uq_chat_participants_chat_id_user_id"),
+    )
 
+
+# messages and private_messages are range-partitioned by month on created_at
+# (see partitions.py), so created_at is part of the primary key.
 class Message(Base):
     __tablename__ = "messages"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
     content = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    content_tsv = deferred(Column(TSVECTOR, Computed(MESSAGE_TSVECTOR, persisted=True)))
 
     chat = relationship("Chat", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        Index("ix_messages_content_tsv", "content_tsv", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+# Cold tier: partitions older than MESSAGE_HOT_MONTHS are detached from messages and attached here.
+# Rows are stored exactly as before (TOAST only compresses values over ~2 kB); the tier keeps
+# them out of hot-path plans and index maintenance rather than saving disk.
+class MessageArchive(Base):
+    __tablename__ = "messages_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    chat_id = Column(Integer)
+    sender_id = Column(Integer)
+    content = Column(Text)
+    created_at = Column(DateTime, primary_key=True)
+    content_tsv = deferred(Column(TSVECTOR, Computed(MESSAGE_TSVECTOR, persisted=True)))
+
+    __table_args__ = (
+        Index("ix_messages_archive_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
 
     
 class PrivateChat(Base):
@@ -107,23 +160,54 @@ class PrivateChat(Base):
     id = Column(Integer, primary_key=True, index=True)
     user1_id = Column(Integer, ForeignKey("users.id"))
     user2_id = Column(Integer, ForeignKey("users.id"))
+    user1_last_read_id = Column(Integer, nullable=True)
+    user2_last_read_id = Column(Integer, nullable=True)
 
     user1 = relationship("User", foreign_keys=[user1_id])
     user2 = relationship("User", foreign_keys=[user2_id])
     messages = relationship("PrivateMessage", back_populates="chat")
 
+    # Pairs are stored as (smaller id, larger id) so each conversation has exactly one row.
+    __table_args__ = (
+        UniqueConstraint("user1_id", "user2_id", name="uq_private_chats_user_pair"),
+        CheckConstraint("user1_id <= user2_id", name="ck_private_chats_canonical_order"),
+    )
+
 
 class PrivateMessage(Base):
     __tablename__ = "private_messages"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     chat_id = Column(Integer, ForeignKey("private_chats.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
     content = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    content_tsv = deferred(Column(TSVECTOR, Computed(MESSAGE_TSVECTOR, persisted=True)))
 
     chat = relationship("PrivateChat", back_populates="messages")
     sender = relationship("User")
+
+    __table_args__ = (
+        Index("ix_private_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        Index("ix_private_messages_content_tsv", "content_tsv", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class PrivateMessageArchive(Base):
+    __tablename__ = "private_messages_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    chat_id = Column(Integer)
+    sender_id = Column(Integer)
+    content = Column(Text)
+    created_at = Column(DateTime, primary_key=True)
+    content_tsv = deferred(Column(TSVECTOR, Computed(MESSAGE_TSVECTOR, persisted=True)))
+
+    __table_args__ = (
+        Index("ix_private_messages_archive_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     
 
 class TaskUpload(Base):
@@ -142,6 +226,10 @@ class TaskUpload(Base):
     student = relationship("User")
     grade = relationship("Grade", back_populates="task_upload", uselist=False)
 
+    __table_args__ = (
+        UniqueConstraint("task_id", "student_id", name="uq_task_uploads_task_id_student_id"),
+    )
+
 
 class Grade(Base):
     __tablename__ = "grades"
@@ -152,3 +240,38 @@ class Grade(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     task_upload = relationship("TaskUpload", back_populates="grade")
+
+    __table_args__ = (
+        UniqueConstraint("task_upload_id", name="uq_grades_task_upload_id"),
+    )
+
+
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    read_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+        Index("ix_notifications_user_id_unread", "user_id", "id", postgresql_where=read_at.is_(None)),
+    )
+
+
+# Sliding-window log for the shared login limiter (rate_limit.py). UNLOGGED: losing it on a
+# crash only resets the windows.
+class LoginAttempt(Base):
+    __tablename__ = "login_attempts"
+
+    id = Column(BigInteger, primary_key=True)
+    key = Column(String, nullable=False)
+    attempted_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_login_attempts_key_attempted_at", "key", "attempted_at"),
+        {"prefixes": ["UNLOGGED"]},
+    )
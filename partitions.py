@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+# Hot tables and the archive table each of them spills into.
+PARTITIONED_TABLES = {
+    "messages": "messages_archive",
+    "private_messages": "private_messages_archive",
+}
+MESSAGE_HOT_MONTHS = int(os.getenv("MESSAGE_HOT_MONTHS", "6"))
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "2"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", str(6 * 60 * 60)))
+
+# Serialises maintenance between workers that start at the same time.
+PARTITION_LOCK_KEY = 72_163_001
+
+PARTITION_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+MESSAGE_COLUMNS = "id, chat_id, sender_id, content, created_at"
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month_index = value.year * 12 + value.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def partition_bounds(month: datetime) -> str:
+    return f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+
+
+def month_filter(month: datetime) -> str:
+    return f"created_at >= '{month:%Y-%m-%d}' AND created_at < '{add_months(month, 1):%Y-%m-%d}'"
+
+
+async def ensure_partitions(conn, now: datetime = None):
+    current = month_start(now or datetime.utcnow())
+    for table, archive_table in PARTITIONED_TABLES.items():
+        # Catches rows for months without a partition (maintenance stopped, clock skew), so
+        # inserts never fail with "no partition of relation found for row".
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT"
+        ))
+        await split_default_partition(conn, table, archive_table)
+        for offset in range(PARTITION_PREMAKE_MONTHS + 1):
+            month = add_months(current, offset)
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} "
+                f"PARTITION OF {table} FOR VALUES {partition_bounds(month)}"
+            ))
+
+
+async def split_default_partition(conn, table: str, archive_table: str):
+    # Moves each month found in the default partition into its own partition. Creating that
+    # partition fails while the default one still holds rows in its range, so they are set
+    # aside, deleted, and re-inserted through the parent once the partition exists.
+    default = default_partition_name(table)
+    result = await conn.execute(text(f"SELECT DISTINCT date_trunc('month', created_at) FROM {default}"))
+    months = sorted(result.scalars().all())
+    if not months:
+        return
+    archived = {month for _, month in await list_partitions(conn, archive_table)}
+    for month in months:
+        await conn.execute(text(
+            f"CREATE TEMPORARY TABLE default_spill AS "
+            f"SELECT {MESSAGE_COLUMNS} FROM {default} WHERE {month_filter(month)}"
+        ))
+        await conn.execute(text(f"DELETE FROM {default} WHERE {month_filter(month)}"))
+        target = archive_table if month in archived else table
+        if target == table:
+            await conn.execute(text(
+                f"CREATE TABLE {partition_name(table, month)} PARTITION OF {table} FOR VALUES {partition_bounds(month)}"
+            ))
+        result = await conn.execute(text(
+            f"INSERT INTO {target} ({MESSAGE_COLUMNS}) SELECT {MESSAGE_COLUMNS} FROM default_spill"
+        ))
+        await conn.execute(text("DROP TABLE default_spill"))
+        logger.warning(f"Moved {result.rowcount} rows for {month:%Y-%m} out of {default} into {target}")
+
+
+async def list_partitions(conn, table: str):
+    result = await conn.execute(
+        text("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+        """),
+        {"table": table}
+    )
+    partitions = []
+    for name in result.scalars().all():
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def archive_old_partitions(conn, hot_months: int = MESSAGE_HOT_MONTHS, now: datetime = None):
+    # Whole months older than the hot window move to the archive table. Detach/attach
+    # only rewrites catalog entries, so the rows themselves are never copied (or compressed).
+    cutoff = add_months(month_start(now or datetime.utcnow()), -hot_months)
+    archived = []
+    for table, archive_table in PARTITIONED_TABLES.items():
+        for name, month in await list_partitions(conn, table):
+            if month >= cutoff:
+                continue
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            await conn.execute(text(
+                f"ALTER TABLE {archive_table} ATTACH PARTITION {name} FOR VALUES {partition_bounds(month)}"
+            ))
+            archived.append(name)
+            logger.info(f"Archived partition {name} into {archive_table}")
+    return archived
+
+
+async def run_maintenance():
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        await ensure_partitions(conn)
+        await archive_old_partitions(conn)
+
+
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            await run_maintenance()
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_maintenance())
@@ -0,0 +1,174 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import sysconfig
+import time
+import traceback
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+import greenlet
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DB_LEAK_THRESHOLD = float(os.getenv("DB_LEAK_THRESHOLD", "30"))
+DB_LEAK_CHECK_INTERVAL = float(os.getenv("DB_LEAK_CHECK_INTERVAL", "15"))
+# Capturing the caller's frames costs tens of microseconds per checkout; needed for leak reports.
+DB_LEAK_TRACE = os.getenv("DB_LEAK_TRACE", "1") == "1"
+DB_LEAK_TRACE_DEPTH = 20
+# Frames from the standard library or installed packages are never the connection's owner.
+LIBRARY_PATHS = (sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"])
+
+WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30]
+
+# Set per request by RouteTagMiddleware so checkouts can be attributed to a route.
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+
+
+class CheckoutRecord:
+    __slots__ = ("pool", "route", "started_at", "stack", "reported")
+
+    def __init__(self, pool: str, route: str, stack: Optional[List[traceback.FrameSummary]]):
+        self.pool = pool
+        self.route = route
+        self.started_at = time.monotonic()
+        self.stack = stack
+        self.reported = False
+
+    @property
+    def owner(self) -> str:
+        if not self.stack:
+            return "unknown caller"
+        frame = self.stack[-1]
+        return f"{frame.name} ({frame.filename}:{frame.lineno})"
+
+
+def caller_stack() -> List[traceback.FrameSummary]:
+    # With the async engine, checkouts run inside SQLAlchemy's greenlet, whose own stack is
+    # only pool and engine internals. The parent greenlet is suspended at the await that is
+    # waiting for this query, so its frames are the coroutine chain that owns the connection.
+    current = greenlet.getcurrent()
+    frame = current.parent.gr_frame if current.parent is not None else sys._getframe(1)
+    stack = [summary for summary in traceback.extract_stack(frame) if not summary.filename.startswith(LIBRARY_PATHS)]
+    return stack[-DB_LEAK_TRACE_DEPTH:]
+
+
+class PoolMonitor:
+    def __init__(self):
+        self.pools = {}
+        self.checkouts: Dict[int, CheckoutRecord] = {}
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.leaks = 0
+        self.task = None
+
+    def attach(self, engine, name: str = "primary"):
+        pool = self.pools[name] = engine.sync_engine.pool
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            stack = caller_stack() if DB_LEAK_TRACE else None
+            self.checkouts[id(connection_record)] = CheckoutRecord(name, current_route.get(), stack)
+
+        event.listen(pool, "checkout", on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        metrics.register_gauge("db_pool", self.stats)
+
+    async def start(self):
+        self.task = asyncio.create_task(self._leak_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def record_wait(self, seconds: float):
+        self.wait_counts[bisect.bisect_left(WAIT_BUCKETS, seconds)] += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.checkouts.pop(id(connection_record), None)
+
+    def stats(self):
+        now = time.monotonic()
+        longest = max(self.checkouts.values(), key=lambda record: now - record.started_at, default=None)
+        waits = sum(self.wait_counts)
+        return {
+            "pools": {
+                name: {
+                    "size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "checked_in": pool.checkedin(),
+                    "overflow": pool.overflow()
+                }
+                for name, pool in self.pools.items()
+            },
+            "wait_seconds": {
+                "count": waits,
+                "avg": round(self.wait_total / waits, 6) if waits else 0.0,
+                "max": round(self.wait_max, 6),
+                "buckets": {
+                    f"le_{bound}": count
+                    for bound, count in zip(WAIT_BUCKETS + ["inf"], self._cumulative_waits())
+                }
+            },
+            "longest_checkout": {
+                "seconds": round(now - longest.started_at, 3),
+                "pool": longest.pool,
+                "route": longest.route,
+                "owner": longest.owner
+            } if longest else None,
+            "leaks_reported": self.leaks
+        }
+
+    def _cumulative_waits(self):
+        total = 0
+        for count in self.wait_counts:
+            total += count
+            yield total
+
+    async def _leak_loop(self):
+        while True:
+            await asyncio.sleep(DB_LEAK_CHECK_INTERVAL)
+            now = time.monotonic()
+            for record in list(self.checkouts.values()):
+                held = now - record.started_at
+                if held < DB_LEAK_THRESHOLD or record.reported:
+                    continue
+                record.reported = True
+                self.leaks += 1
+                stack = "".join(traceback.format_list(record.stack)) if record.stack else "(stack capture disabled)\n"
+                logger.warning(
+                    f"DB connection from the {record.pool} pool held for {held:.1f}s by {record.route} "
+                    f"in {record.owner}, checked out from:\n{stack}"
+                )
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_monitor.record_wait(time.perf_counter() - started)
+
+
+class RouteTagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            method = scope.get("method", "WS")
+            current_route.set(f"{method} {scope['path']}")
+        await self.app(scope, receive, send)
+
+
+pool_monitor = PoolMonitor()
@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Hashable, List, Tuple
+
+from sqlalchemy import text
+
+from cache import TTLCache
+from database import engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CHAT_USER_RATE = float(os.getenv("CHAT_USER_RATE", "5"))
+CHAT_USER_BURST = float(os.getenv("CHAT_USER_BURST", "10"))
+CHAT_ROOM_RATE = float(os.getenv("CHAT_ROOM_RATE", "50"))
+CHAT_ROOM_BURST = float(os.getenv("CHAT_ROOM_BURST", "100"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "50000"))
+# Throttled senders are remembered for this long (and up to this many) for the metrics endpoint.
+THROTTLED_SENDERS_TTL = float(os.getenv("THROTTLED_SENDERS_TTL", "3600"))
+THROTTLED_SENDERS_MAX = int(os.getenv("THROTTLED_SENDERS_MAX", "10000"))
+
+# "memory" keeps login windows per worker; "postgres" also shares them between workers.
+LOGIN_LIMIT_BACKEND = os.getenv("LOGIN_LIMIT_BACKEND", "memory")
+LOGIN_WINDOW = float(os.getenv("LOGIN_WINDOW", "60"))
+LOGIN_IP_LIMIT = int(os.getenv("LOGIN_IP_LIMIT", "20"))
+LOGIN_EMAIL_LIMIT = int(os.getenv("LOGIN_EMAIL_LIMIT", "5"))
+LOGIN_PURGE_INTERVAL = float(os.getenv("LOGIN_PURGE_INTERVAL", "300"))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def retry_after(self, cost: float = 1) -> float:
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1):
+        self.tokens -= cost
+
+
+class BucketSet:
+    def __init__(self, rate: float, capacity: float, maxsize: int = RATE_LIMIT_MAX_BUCKETS):
+        self.rate = rate
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def get(self, key: Hashable, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+            # The least recently used bucket has been idle longest and is usually full again anyway.
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        bucket.refill(now)
+        return bucket
+
+
+class ChatRateLimiter:
+    def __init__(self):
+        self.users = BucketSet(CHAT_USER_RATE, CHAT_USER_BURST)
+        self.rooms = BucketSet(CHAT_ROOM_RATE, CHAT_ROOM_BURST)
+        # Per-sender counts live in a bounded cache rather than a metrics counter, which
+        # would keep a label for every sender ever throttled.
+        self.throttled_senders = TTLCache(THROTTLED_SENDERS_MAX, THROTTLED_SENDERS_TTL)
+        metrics.register_gauge("chat_rate_limit_buckets", lambda: {
+            "users": len(self.users.buckets),
+            "rooms": len(self.rooms.buckets)
+        })
+        metrics.register_gauge("chat_throttled_senders", self.throttled_senders_stats)
+
+    def acquire(self, user_id: int, room: Hashable) -> float:
+        # Returns 0 when the message may be sent, otherwise seconds until it would be allowed.
+        # Tokens are only taken when both buckets allow it, so a rejected frame costs nothing.
+        now = time.monotonic()
+        user_bucket = self.users.get(user_id, now)
+        room_bucket = self.rooms.get(room, now)
+
+        retry_after = max(user_bucket.retry_after(), room_bucket.retry_after())
+        if retry_after:
+            scope = "user" if user_bucket.retry_after() else "room"
+            metrics.increment("chat_throttled_messages", scope)
+            self.throttled_senders.set(user_id, self.throttled_senders.get(user_id, 0) + 1)
+            return retry_after
+
+        user_bucket.consume()
+        room_bucket.consume()
+        return 0.0
+
+    def throttled_senders_stats(self, limit: int = 20):
+        now = time.monotonic()
+        active = [(count, user_id) for user_id, (expires_at, count) in self.throttled_senders.entries.items() if expires_at >= now]
+        return {
+            "senders": len(active),
+            "top": {str(user_id): count for count, user_id in heapq.nlargest(limit, active)}
+        }
+
+
+chat_rate_limiter = ChatRateLimiter()
+
+
+class LocalWindowBackend:
+    # Sliding-window log of failed attempt times per key, held in this process.
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_BUCKETS):
+        self.maxsize = maxsize
+        self.windows: "OrderedDict[str, deque]" = OrderedDict()
+
+    async def retry_after(self, key: str, limit: int, window: float) -> float:
+        attempts = self.windows.get(key)
+        if not attempts:
+            return 0.0
+        now = time.monotonic()
+        while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+        if len(attempts) >= limit:
+            return attempts[0] + window - now
+        return 0.0
+
+    async def record(self, keys: List[str], window: float):
+        now = time.monotonic()
+        for key in keys:
+            attempts = self.windows.get(key)
+            if attempts is None:
+                attempts = self.windows[key] = deque()
+                while len(self.windows) > self.maxsize:
+                    self.windows.popitem(last=False)
+            else:
+                self.windows.move_to_end(key)
+            while attempts and attempts[0] <= now - window:
+                attempts.popleft()
+            attempts.append(now)
+
+    async def clear(self, key: str):
+        self.windows.pop(key, None)
+
+
+class PostgresWindowBackend:
+    # The same sliding-window log kept in an UNLOGGED table so every worker sees all attempts.
+    def __init__(self):
+        self.purge_task = None
+
+    async def start(self):
+        self.purge_task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self.purge_task:
+            self.purge_task.cancel()
+            self.purge_task = None
+
+    async def retry_after(self, key: str, limit: int, window: float) -> float:
+        async with engine.connect() as conn:
+            result = await conn.execute(LOGIN_ATTEMPT_CHECK, {"key": key, "window": window})
+            attempts, retry_after = result.one()
+        if attempts >= limit:
+            return max(float(retry_after or 0), 0.0)
+        return 0.0
+
+    async def record(self, keys: List[str], window: float):
+        async with engine.begin() as conn:
+            await conn.execute(LOGIN_ATTEMPT_RECORD, [{"key": key} for key in keys])
+
+    async def clear(self, key: str):
+        async with engine.begin() as conn:
+            await conn.execute(LOGIN_ATTEMPT_CLEAR, {"key": key})
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(LOGIN_PURGE_INTERVAL)
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(LOGIN_ATTEMPT_PURGE, {"window": LOGIN_WINDOW})
+            except Exception as e:
+                logger.error(f"Failed to purge login attempts: {e}")
+
+
+LOGIN_ATTEMPT_CHECK = text("""
+    SELECT count(*), EXTRACT(EPOCH FROM min(attempted_at) + make_interval(secs => :window) - now())
+    FROM login_attempts
+    WHERE key = :key AND attempted_at > now() - make_interval(secs => :window)
+""")
+
+LOGIN_ATTEMPT_RECORD = text("""
+    INSERT INTO login_attempts (key, attempted_at) VALUES (:key, now())
+""")
+
+LOGIN_ATTEMPT_CLEAR = text("""
+    DELETE FROM login_attempts WHERE key = :key
+""")
+
+LOGIN_ATTEMPT_PURGE = text("""
+    DELETE FROM login_attempts WHERE attempted_at < now() - make_interval(secs => :window)
+""")
+
+
+class LoginLimiter:
+    # Only failed logins count, so a class behind one NAT address or a user signing in and out
+    # is never locked out; a successful login also clears its email's window.
+    def __init__(self, shared=None):
+        # The local windows are always checked first, so a burst against one worker is turned
+        # away without touching the database; the shared backend then enforces the global limit.
+        self.local = LocalWindowBackend()
+        self.shared = shared
+
+    async def start(self):
+        if self.shared:
+            await self.shared.start()
+
+    async def stop(self):
+        if self.shared:
+            await self.shared.stop()
+
+    @property
+    def backends(self):
+        return [self.local, self.shared] if self.shared else [self.local]
+
+    def email_key(self, email: str) -> str:
+        return f"email:{email.strip().lower()}"
+
+    def rules(self, ip: str, email: str) -> List[Tuple[str, str, int]]:
+        return [
+            ("ip", f"ip:{ip}", LOGIN_IP_LIMIT),
+            ("email", self.email_key(email), LOGIN_EMAIL_LIMIT),
+        ]
+
+    async def check(self, ip: str, email: str) -> float:
+        # Returns 0 when the attempt may proceed, otherwise seconds until it would be allowed.
+        for backend in self.backends:
+            for scope, key, limit in self.rules(ip, email):
+                retry_after = await backend.retry_after(key, limit, LOGIN_WINDOW)
+                if retry_after:
+                    metrics.increment("login_rejected", scope)
+                    return retry_after
+        return 0.0
+
+    async def record_failure(self, ip: str, email: str):
+        keys = [key for _, key, _ in self.rules(ip, email)]
+        for backend in self.backends:
+            await backend.record(keys, LOGIN_WINDOW)
+
+    async def record_success(self, email: str):
+        for backend in self.backends:
+            await backend.clear(self.email_key(email))
+
+
+def create_login_limiter():
+    if LOGIN_LIMIT_BACKEND == "postgres":
+        return LoginLimiter(PostgresWindowBackend())
+    return LoginLimiter()
+
+
+login_limiter = create_login_limiter()
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List
+
+import asyncpg
+from dotenv import load_dotenv
+from fastapi import WebSocket
+
+from database import base_url, DB_SSL_MODE
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REALTIME_BACKEND = os.getenv("REALTIME_BACKEND", "memory")
+REALTIME_PG_CHANNEL = os.getenv("REALTIME_PG_CHANNEL", "realtime")
+REALTIME_RECONNECT_DELAY = float(os.getenv("REALTIME_RECONNECT_DELAY", "2"))
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# Sent when a slow consumer is dropped; clients should refetch history and reconnect.
+WS_RESYNC_CLOSE_CODE = 4001
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more.
+PG_NOTIFY_MAX_BYTES = 7999
+# Larger events are split into parts of this many characters. Envelopes are ASCII (json.dumps
+# escapes the rest) and re-encoding a part at most doubles it, so each part stays under the limit.
+PG_NOTIFY_PART_CHARS = 3900
+# Events still missing parts are forgotten oldest first beyond this many.
+PG_NOTIFY_MAX_PARTIAL = 256
+
+Handler = Callable[[Any, str], Awaitable[None]]
+
+
+class QueuedConnection:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_evict: Callable[["QueuedConnection"], None] = None,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        send_timeout: float = WS_SEND_TIMEOUT
+    ):
+        self.websocket = websocket
+        self.on_evict = on_evict
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.send_timeout = send_timeout
+        self.writer_task = None
+        self.closed = False
+
+    def start(self):
+        self.writer_task = asyncio.create_task(self._write())
+
+    def enqueue(self, payload: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            self.evict("send queue overflow")
+            return False
+
+    def evict(self, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        logger.warning(f"Evicting websocket consumer: {reason}")
+        if self.on_evict:
+            self.on_evict(self)
+        asyncio.create_task(self._close(reason))
+
+    def stop(self):
+        self.closed = True
+        if self.writer_task:
+            self.writer_task.cancel()
+
+    async def _close(self, reason: str):
+        if self.writer_task:
+            self.writer_task.cancel()
+        try:
+            await self.websocket.close(code=WS_RESYNC_CLOSE_CODE, reason=reason)
+        except Exception:
+            pass
+
+    async def _write(self):
+        try:
+            while True:
+                payload = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.evict(f"send failed: {e}")
+
+
+class InProcessBroker:
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = defaultdict(list)
+
+    def subscribe(self, topic: str, handler: Handler):
+        self.handlers[topic].append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, topic: str, key: Any, payload: str):
+        await self.dispatch(topic, key, payload)
+
+    async def dispatch(self, topic: str, key: Any, payload: str):
+        for handler in self.handlers.get(topic, []):
+            try:
+                await handler(key, payload)
+            except Exception as e:
+                logger.error(f"Realtime handler for {topic} failed: {e}")
+
+
+class PostgresBroker(InProcessBroker):
+    def __init__(self, dsn: str, channel: str = REALTIME_PG_CHANNEL):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.listen_conn = None
+        self.publish_pool = None
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.partial: "OrderedDict[str, list]" = OrderedDict()
+        self.consumer_task = None
+        self.stopping = False
+
+    async def start(self):
+        self.stopping = False
+        self.publish_pool = await asyncpg.create_pool(self.dsn, ssl=DB_SSL_MODE, min_size=1, max_size=2)
+        await self._listen()
+        self.consumer_task = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        self.stopping = True
+        if self.consumer_task:
+            self.consumer_task.cancel()
+        if self.listen_conn and not self.listen_conn.is_closed():
+            await self.listen_conn.close()
+        if self.publish_pool:
+            await self.publish_pool.close()
+
+    async def publish(self, topic: str, key: Any, payload: str):
+        envelope = json.dumps({"t": topic, "k": key, "p": payload})
+        if len(envelope) <= PG_NOTIFY_MAX_BYTES:
+            await self.publish_pool.execute("SELECT pg_notify($1, $2)", self.channel, envelope)
+            return
+
+        # Too large for one NOTIFY: send numbered parts in one transaction so they are delivered
+        # together, and let every listener (this worker included) put the event back together.
+        event_id = uuid.uuid4().hex
+        chunks = [envelope[i:i + PG_NOTIFY_PART_CHARS] for i in range(0, len(envelope), PG_NOTIFY_PART_CHARS)]
+        parts = [
+            (self.channel, json.dumps({"c": event_id, "i": index, "n": len(chunks), "d": chunk}))
+            for index, chunk in enumerate(chunks)
+        ]
+        async with self.publish_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany("SELECT pg_notify($1, $2)", parts)
+
+    async def _listen(self):
+        self.listen_conn = await asyncpg.connect(self.dsn, ssl=DB_SSL_MODE)
+        self.listen_conn.add_termination_listener(self._on_terminated)
+        await self.listen_conn.add_listener(self.channel, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.inbox.put_nowait(payload)
+
+    def _on_terminated(self, connection):
+        if not self.stopping:
+            logger.warning("Realtime LISTEN connection lost, reconnecting")
+            asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self.stopping:
+            try:
+                await self._listen()
+                return
+            except Exception as e:
+                logger.error(f"Realtime reconnect failed: {e}")
+                await asyncio.sleep(REALTIME_RECONNECT_DELAY)
+
+    async def _consume(self):
+        # A single consumer keeps delivery in NOTIFY order.
+        while True:
+            raw = await self.inbox.get()
+            try:
+                envelope = json.loads(raw)
+            except ValueError:
+                logger.error("Dropping malformed realtime event")
+                continue
+            if "c" in envelope:
+                envelope = self._assemble(envelope)
+                if envelope is None:
+                    continue
+            await self.dispatch(envelope["t"], envelope["k"], envelope["p"])
+
+    def _assemble(self, part: dict):
+        chunks = self.partial.get(part["c"])
+        if chunks is None:
+            chunks = self.partial[part["c"]] = [None] * part["n"]
+            while len(self.partial) > PG_NOTIFY_MAX_PARTIAL:
+                event_id, _ = self.partial.popitem(last=False)
+                logger.error(f"Dropping realtime event {event_id}: parts never arrived")
+        chunks[part["i"]] = part["d"]
+        if any(chunk is None for chunk in chunks):
+            return None
+        del self.partial[part["c"]]
+        return json.loads("".join(chunks))
+
+
+def create_broker():
+    if REALTIME_BACKEND == "postgres":
+        return PostgresBroker(base_url)
+    return InProcessBroker()
+
+
+broker = create_broker()
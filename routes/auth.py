@@ -1,3 +1,5 @@
+import math
+
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Form, Response
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
@@ -7,6 +9,7 @@ import models, schemas, security
 from database import get_db
 from security import get_current_user_optional
 from routes.notifications import send_notification
+from rate_limit import login_limiter
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -15,8 +18,17 @@ templates = Jinja2Templates(directory="templates")
 async def authenticate_user(email: str, password: str, db: AsyncSession):
     result = await db.execute(select(models.User).filter(models.User.email == email))
     user = result.scalar_one_or_none()
-    if not user or not security.verify_password(password, user.hashed_password):
+    if not user:
         return None
+
+    verified, new_hash = await security.verify_and_update_password(password, user.hashed_password)
+    if not verified:
+        return None
+
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        await security.invalidate_principal(user.email)
     return user
 
 
@@ -95,7 +107,7 @@ async def register(
     if result.scalar_one_or_none():
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = security.get_password_hash(password)
+    hashed_password = await security.get_password_hash(password)
     db_user = models.User(
         email=email,
         username=username,
@@ -118,28 +130,33 @@ async def register(
 
 @router.post("/login")
 async def login(
+        request: Request,
         email: str = Form(...),
         password: str = Form(...),
         db: AsyncSession = Depends(get_db)
 ):
+    # Checked before the user lookup and bcrypt so a burst of bad logins stays cheap.
+    ip = request.client.host if request.client else "unknown"
+    retry_after = await login_limiter.check(ip, email)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
     user = await authenticate_user(email, password, db)
     if not user:
+        await login_limiter.record_failure(ip, email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
+    await login_limiter.record_success(email)
 
-    access_token = security.create_access_token(data={"sub": email})
+    access_token = await security.create_user_token(db, user)
     response = RedirectResponse(url="/?message=Login successful!", status_code=303)
-
-    response.set_cookie(
-        key="access_token",
-        value=f"Bearer {access_token}",
-        httponly=True,
-        max_age=1800,
-        expires=1800,
-        samesite="lax"
-    )
+    security.set_access_cookie(response, access_token)
 
     result = await db.execute(select(models.User).filter(models.User == True))
     all_admins = result.scalars().all()
@@ -1,55 +1,469 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request
-from typing import List, Dict
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request, Query
+from typing import List, Dict, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Chat, ChatParticipant, Message, Subject, User, PrivateChat, PrivateMessage, Enrollment
-from sqlalchemy import select, and_
+from models import Chat, ChatParticipant, Message, Subject, User, PrivateChat, PrivateMessage, Enrollment, SEARCH_CONFIG
+from models import MessageArchive, PrivateMessageArchive
+from sqlalchemy import select, and_, or_, tuple_, text, func, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload
-from database import get_db
+from database import get_db, get_read_db
 import datetime
 import asyncio
 from fastapi.templating import Jinja2Templates
 import json
-from security import get_current_user_for_id, get_current_user_ws
+import base64
+import html
+import os
+from collections import OrderedDict, deque
+from itertools import islice
+from security import get_current_user_for_id, get_current_user_ws, get_token_claims
+from realtime import broker, QueuedConnection
+from message_writer import message_writer, read_cursors
+from membership import get_chat_subject_id, is_subject_member
+from cache import TTLCache
+from rate_limit import chat_rate_limiter
 import logging
 from starlette.websockets import WebSocketState
 
 logger = logging.getLogger(__name__)
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+PRIVATE_CHAT_CACHE_SIZE = int(os.getenv("PRIVATE_CHAT_CACHE_SIZE", "10000"))
+PRIVATE_CHAT_CACHE_TTL = float(os.getenv("PRIVATE_CHAT_CACHE_TTL", "3600"))
+REPLAY_BUFFER_SIZE = int(os.getenv("CHAT_REPLAY_BUFFER_SIZE", "200"))
+REPLAY_BUFFER_CHATS = int(os.getenv("CHAT_REPLAY_BUFFER_CHATS", "5000"))
+REPLAY_DB_LIMIT = int(os.getenv("CHAT_REPLAY_DB_LIMIT", "500"))
+# Messages committed this long before the last seen one may still have been delivered after it.
+REPLAY_REORDER_WINDOW = float(os.getenv("CHAT_REPLAY_REORDER_WINDOW", "5"))
+ARCHIVE_MODELS = {Message: MessageArchive, PrivateMessage: PrivateMessageArchive}
+SEARCH_PAGE_SIZE = 20
+# ts_headline marks matches with control characters; the snippet is HTML-escaped first and
+# only then are they turned into <mark> tags, so message text can never inject markup.
+SEARCH_MATCH_START = "\x02"
+SEARCH_MATCH_STOP = "\x03"
+SEARCH_HEADLINE_OPTIONS = (
+    f'StartSel="{SEARCH_MATCH_START}", StopSel="{SEARCH_MATCH_STOP}", MaxFragments=2, MaxWords=20, MinWords=5'
+)
+# Unread counts stop at this value; the inbox shows "99+" rather than scanning long backlogs.
+INBOX_UNREAD_CAP = 100
+# Message ids are INTEGER columns; anything larger in a read receipt cannot be a real message.
+MAX_MESSAGE_ID = 2 ** 31 - 1
+
+# Group chats the user participates in plus private chats with at least one message,
+# each with its latest message and an unread count past the user's read cursor.
+INBOX_QUERY = text("""
+    SELECT
+        'group' AS kind,
+        c.id AS chat_id,
+        c.name AS title,
+        NULL AS peer_username,
+        lm.id AS last_message_id,
+        lm.content AS last_message,
+        lm.created_at AS last_message_at,
+        lm.sender_id AS last_sender_id,
+        unread.count AS unread_count
+    FROM chat_participants cp
+    JOIN chats c ON c.id = cp.chat_id
+    LEFT JOIN LATERAL (
+        SELECT m.id, m.content, m.created_at, m.sender_id
+        FROM messages m
+        WHERE m.chat_id = c.id
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT 1
+    ) lm ON TRUE
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS count FROM (
+            SELECT 1
+            FROM messages m
+            WHERE m.chat_id = c.id
+              AND m.id > COALESCE(cp.last_read_message_id, 0)
+              AND m.sender_id <> cp.user_id
+            LIMIT :unread_cap
+        ) capped
+    ) unread
+    WHERE cp.user_id = :user_id
+
+    UNION ALL
+
+    SELECT
+        'private' AS kind,
+        pc.id AS chat_id,
+        peer.username AS title,
+        peer.username AS peer_username,
+        lm.id,
+        lm.content,
+        lm.created_at,
+        lm.sender_id,
+        unread.count
+    FROM private_chats pc
+    JOIN users peer ON peer.id = CASE WHEN pc.user1_id = :user_id THEN pc.user2_id ELSE pc.user1_id END
+    JOIN LATERAL (
+        SELECT pm.id, pm.content, pm.created_at, pm.sender_id
+        FROM private_messages pm
+        WHERE pm.chat_id = pc.id
+        ORDER BY pm.created_at DESC, pm.id DESC
+        LIMIT 1
+    ) lm ON TRUE
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS count FROM (
+            SELECT 1
+            FROM private_messages pm
+            WHERE pm.chat_id = pc.id
+              AND pm.id > COALESCE(
+                  CASE WHEN pc.user1_id = :user_id THEN pc.user1_last_read_id ELSE pc.user2_last_read_id END, 0
+              )
+              AND pm.sender_id <> :user_id
+            LIMIT :unread_cap
+        ) capped
+    ) unread
+    WHERE pc.user1_id = :user_id OR pc.user2_id = :user_id
+
+    ORDER BY last_message_at DESC NULLS LAST
+""")
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
 
-    async def connect(self, chat_id: int, websocket: WebSocket):
+class ConnectionManager:
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.active_connections: Dict[int, Dict[int, QueuedConnection]] = {}
+        # Most recent (id, payload) pairs per chat, used to replay missed messages on reconnect.
+        self.recent: "OrderedDict[int, deque]" = OrderedDict()
+        broker.subscribe(channel, self.deliver)
+
+    async def connect(self, chat_id: int, websocket: WebSocket) -> QueuedConnection:
         try:
             await websocket.accept()
-            if chat_id not in self.active_connections:
-                self.active_connections[chat_id] = []
-            self.active_connections[chat_id].append(websocket)
+            connection = QueuedConnection(
+                websocket, on_evict=lambda conn: self._remove(chat_id, conn.websocket)
+            )
+            connection.start()
+            self.active_connections.setdefault(chat_id, {})[id(websocket)] = connection
+            return connection
         except Exception as e:
             raise WebSocketDisconnect(f"Error while connecting: {e}")
 
     def disconnect(self, chat_id: int, websocket: WebSocket):
-        try:
-            if chat_id in self.active_connections:
-                self.active_connections[chat_id].remove(websocket)
-                if not self.active_connections[chat_id]:
-                    del self.active_connections[chat_id]
-        except Exception as e:
-            raise WebSocketDisconnect(f"Error while disconnecting: {e}")
+        connection = self._remove(chat_id, websocket)
+        if connection:
+            connection.stop()
+
+    def _remove(self, chat_id: int, websocket: WebSocket):
+        room = self.active_connections.get(chat_id)
+        if room is None:
+            return None
+        connection = room.pop(id(websocket), None)
+        if not room:
+            del self.active_connections[chat_id]
+        return connection
+
+    def replay(self, chat_id: int, connection: QueuedConnection, last_seen_id: int) -> bool:
+        # Replays by position, not by id: ids from different writer batches can be delivered
+        # out of order. The client has seen a prefix of the delivery order ending at or after
+        # its highest id, so everything after that entry is resent (clients dedupe by id).
+        buffer = self.recent.get(chat_id)
+        if not buffer:
+            return False
+        for position, (message_id, _) in enumerate(buffer):
+            if message_id == last_seen_id:
+                break
+        else:
+            return False
+        for _, payload in islice(buffer, position + 1, None):
+            connection.enqueue(payload)
+        return True
+
+    def _remember(self, chat_id: int, message: str):
+        message_id = json.loads(message).get("id")
+        if message_id is None:
+            return
+        buffer = self.recent.get(chat_id)
+        if buffer is None:
+            buffer = self.recent[chat_id] = deque(maxlen=REPLAY_BUFFER_SIZE)
+        self.recent.move_to_end(chat_id)
+        buffer.append((message_id, message))
+        while len(self.recent) > REPLAY_BUFFER_CHATS:
+            self.recent.popitem(last=False)
 
     async def broadcast(self, chat_id: int, message: str):
-        try:
-            if chat_id in self.active_connections:
-                for connection in self.active_connections[chat_id]:
-                    await connection.send_text(message)
-        except Exception as e:
-            raise WebSocketDisconnect(f"Error while broadcasting: {e}")
+        # Goes through the broker so sockets held by other workers receive it too.
+        await broker.publish(self.channel, chat_id, message)
+
+    async def deliver(self, chat_id: int, message: str):
+        # Only enqueues: each connection's writer task does the actual send,
+        # so one stalled client cannot hold up the rest of the room.
+        self._remember(chat_id, message)
+        room = self.active_connections.get(chat_id)
+        if room:
+            for connection in list(room.values()):
+                connection.enqueue(message)
 
 
 router = APIRouter()
-manager = ConnectionManager()
+manager = ConnectionManager("chat")
+private_manager = ConnectionManager("private_chat")
 templates = Jinja2Templates(directory="templates")
+private_chat_ids = TTLCache(PRIVATE_CHAT_CACHE_SIZE, PRIVATE_CHAT_CACHE_TTL)
+
+
+def encode_cursor(created_at: datetime.datetime, message_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(created_at), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    raw = f"{rank!r}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        rank, message_id = raw.rsplit("|", 1)
+        return float(rank), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def get_private_chat_id(db: AsyncSession, user_id: int, other_user_id: int) -> Optional[int]:
+    pair = (min(user_id, other_user_id), max(user_id, other_user_id))
+    chat_id = private_chat_ids.get(pair)
+    if chat_id is not None:
+        return chat_id
+
+    result = await db.execute(
+        select(PrivateChat.id).filter(PrivateChat.user1_id == pair[0], PrivateChat.user2_id == pair[1])
+    )
+    chat_id = result.scalar_one_or_none()
+    if chat_id is not None:
+        private_chat_ids.set(pair, chat_id)
+    return chat_id
+
+
+async def get_or_create_private_chat_id(db: AsyncSession, user_id: int, other_user_id: int) -> int:
+    chat_id = await get_private_chat_id(db, user_id, other_user_id)
+    if chat_id is not None:
+        return chat_id
+
+    # Only a brand-new pair gets here. DO NOTHING leaves an existing row untouched when two
+    # users race to create it; the loser then reads the winner's row.
+    pair = (min(user_id, other_user_id), max(user_id, other_user_id))
+    stmt = (
+        pg_insert(PrivateChat)
+        .values(user1_id=pair[0], user2_id=pair[1])
+        .on_conflict_do_nothing(constraint="uq_private_chats_user_pair")
+        .returning(PrivateChat.id)
+    )
+    result = await db.execute(stmt)
+    chat_id = result.scalar_one_or_none()
+    await db.commit()
+    if chat_id is None:
+        chat_id = await get_private_chat_id(db, user_id, other_user_id)
+
+    private_chat_ids.set(pair, chat_id)
+    return chat_id
+
+
+async def fetch_history_page(
+    db: AsyncSession,
+    model,
+    chat_id: int,
+    columns: tuple,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = HISTORY_PAGE_SIZE
+):
+    # Keyset pagination on (created_at, id), served by the (chat_id, created_at, id) index.
+    # Without a cursor the newest page is returned; rows always come back oldest first.
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
+    # Every archived row is older than every hot row, so a page is completed from the
+    # archive only when the hot table runs out (walking back) or before it (walking forward).
+    sources = [model, ARCHIVE_MODELS[model]]
+    if after:
+        sources.reverse()
+    cursor = decode_cursor(after or before) if (after or before) else None
+
+    rows = []
+    for source in sources:
+        key = tuple_(source.created_at, source.id)
+        query = (
+            select(source, *columns)
+            .join(User, User.id == source.sender_id)
+            .filter(source.chat_id == chat_id)
+        )
+        if after:
+            query = query.filter(key > tuple_(*cursor)).order_by(source.created_at, source.id)
+        else:
+            if cursor:
+                query = query.filter(key < tuple_(*cursor))
+            query = query.order_by(source.created_at.desc(), source.id.desc())
+
+        result = await db.execute(query.limit(limit + 1 - len(rows)))
+        rows.extend(result.all())
+        if len(rows) > limit:
+            break
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after:
+        rows.reverse()
+
+    if rows:
+        first, last = rows[0][0], rows[-1][0]
+        prev_cursor = encode_cursor(first.created_at, first.id) if (has_more or after) else None
+        next_cursor = encode_cursor(last.created_at, last.id)
+    else:
+        prev_cursor = None
+        next_cursor = after
+
+    return rows, {"has_more": has_more, "prev_cursor": prev_cursor, "next_cursor": next_cursor}
+
+
+def highlight_snippet(snippet: str) -> str:
+    return (
+        html.escape(snippet)
+        .replace(SEARCH_MATCH_START, "<mark>")
+        .replace(SEARCH_MATCH_STOP, "</mark>")
+    )
+
+
+async def search_chat_messages(
+    db: AsyncSession,
+    model,
+    chat_id: int,
+    q: str,
+    cursor: Optional[str] = None,
+    limit: int = SEARCH_PAGE_SIZE
+):
+    # Ranked by ts_rank, then id, with the keyset cursor taken over that same (rank, id) pair.
+    config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+    tsquery = func.websearch_to_tsquery(config, q)
+    rank = func.ts_rank(model.content_tsv, tsquery)
+    query = (
+        select(
+            model.id,
+            model.sender_id,
+            model.created_at,
+            User.username,
+            rank.label("rank"),
+            func.ts_headline(config, model.content, tsquery, SEARCH_HEADLINE_OPTIONS).label("snippet")
+        )
+        .join(User, User.id == model.sender_id)
+        .filter(model.chat_id == chat_id, model.content_tsv.op("@@")(tsquery))
+    )
+    if cursor:
+        query = query.filter(tuple_(rank, model.id) < tuple_(*decode_search_cursor(cursor)))
+
+    result = await db.execute(query.order_by(rank.desc(), model.id.desc()).limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        "has_more": has_more,
+        "next_cursor": encode_search_cursor(rows[-1].rank, rows[-1].id) if has_more else None,
+        "hits": [
+            {
+                "id": row.id,
+                "sender_id": row.sender_id,
+                "username": row.username,
+                "created_at": row.created_at,
+                "rank": row.rank,
+                "snippet": highlight_snippet(row.snippet)
+            }
+            for row in rows
+        ]
+    }
+
+
+def send_error(connection: QueuedConnection, code: str, detail: str, **extra):
+    connection.enqueue(json.dumps({"type": "error", "code": code, "detail": detail, **extra}))
+
+
+def reject_if_throttled(connection: QueuedConnection, user_id: int, room) -> bool:
+    retry_after = chat_rate_limiter.acquire(user_id, room)
+    if not retry_after:
+        return False
+    send_error(connection, "rate_limited", "Too many messages, slow down", retry_after=round(retry_after, 3))
+    return True
+
+
+async def persist_message(connection: QueuedConnection, model, values: dict) -> Optional[int]:
+    # A message that cannot be stored is reported on the socket, which stays open.
+    try:
+        return await message_writer.submit(model, values)
+    except Exception as e:
+        logger.error(f"Chat message from user {values['sender_id']} was not saved: {e}")
+        send_error(connection, "not_saved", "Message could not be saved")
+        return None
+
+
+def parse_read_receipt(connection: QueuedConnection, message_data: dict) -> Optional[int]:
+    try:
+        message_id = int(message_data["message_id"])
+    except (KeyError, TypeError, ValueError):
+        message_id = None
+    if message_id is None or not 0 < message_id <= MAX_MESSAGE_ID:
+        send_error(connection, "invalid_read", "message_id must be a message id")
+        return None
+    return message_id
+
+
+def parse_last_seen_id(websocket: WebSocket) -> Optional[int]:
+    try:
+        return int(websocket.query_params["last_seen_id"])
+    except (KeyError, ValueError):
+        return None
+
+
+async def replay_from_db(db: AsyncSession, model, chat_id: int, last_seen_id: int, connection: QueuedConnection):
+    # Ids do not follow commit order exactly, so rows written shortly before the last seen
+    # message are resent as well; the client drops the ones it already has.
+    last_seen_at = (
+        select(model.created_at)
+        .filter(model.chat_id == chat_id, model.id == last_seen_id)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        select(model, User.username, User.avatar_url)
+        .join(User, User.id == model.sender_id)
+        .filter(
+            model.chat_id == chat_id,
+            or_(
+                model.id > last_seen_id,
+                model.created_at >= last_seen_at - datetime.timedelta(seconds=REPLAY_REORDER_WINDOW)
+            )
+        )
+        .order_by(model.created_at, model.id)
+        .limit(REPLAY_DB_LIMIT + 1)
+    )
+    rows = result.all()
+
+    if len(rows) > REPLAY_DB_LIMIT:
+        # Too far behind to replay frame by frame: make the client reload history instead.
+        connection.evict("replay gap too large")
+        return
+
+    for msg, username, avatar_url in rows:
+        connection.enqueue(json.dumps({
+            "id": msg.id,
+            "sender_id": msg.sender_id,
+            "username": username,
+            "avatar_url": avatar_url,
+            "content": msg.content,
+            "created_at": msg.created_at.isoformat()
+        }))
 
 
 """PAGES"""
@@ -58,7 +472,7 @@ async def list_of_chats_page(request: Request, current_user: User = Depends(get_
     return templates.TemplateResponse("chats.html", {"request": request, "user": current_user})
 
 @router.get("/user/chat/{username}")
-async def list_of_chats_page(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user_for_id), username: str = None):
+async def list_of_chats_page(request: Request, current_user: User = Depends(get_current_user_for_id), username: str = None):
     return templates.TemplateResponse("private_chat.html", {"request": request, "user": current_user, "username": username})
 
 @router.get("/my_chats/{chat_id}")
@@ -90,7 +504,7 @@ async def chat_page(
 """WEBSOCKETS"""
 # FOR GROUP
 @router.websocket("/ws/chat/{chat_id}")
-async def websocket_chat(chat_id: int, websocket: WebSocket, token = Depends(get_current_user_for_id), db: AsyncSession = Depends(get_db)):
+async def websocket_chat(chat_id: int, websocket: WebSocket, token = Depends(get_current_user_for_id), claims = Depends(get_token_claims), db: AsyncSession = Depends(get_db)):
     try:
         if not token:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -98,58 +512,55 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token = Depends(get
 
         user_id = token.id
         
-        chat_query = await db.execute(
-            select(Chat).filter_by(id=chat_id)
-        )
-        chat = chat_query.scalar_one_or_none()
+        subject_id = await get_chat_subject_id(db, chat_id)
         
-        if not chat:
+        if subject_id is None or not await is_subject_member(db, subject_id, user_id, claims):
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
-            
-        subject_query = await db.execute(
-            select(Subject).filter_by(id=chat.subject_id)
-        )
-        subject = subject_query.scalar_one_or_none()
-        
-        is_teacher = subject and subject.teacher_id == user_id
-        
-        if not is_teacher:
-            enrollment_query = await db.execute(
-                select(Enrollment).filter_by(
-                    student_id=user_id,
-                    subject_id=chat.subject_id
-                )
-            )
-            is_student = enrollment_query.scalar_one_or_none() is not None
-            
-            if not is_student:
-                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-                return
 
-        await manager.connect(chat_id, websocket)
+        connection = await manager.connect(chat_id, websocket)
+
+        last_seen_id = parse_last_seen_id(websocket)
+        if last_seen_id is not None and not manager.replay(chat_id, connection, last_seen_id):
+            await replay_from_db(db, Message, chat_id, last_seen_id, connection)
 
         user = await db.execute(select(User.username, User.avatar_url).filter_by(id=user_id))
         user = user.first()
+        # Messages are persisted by the shared writer, so the socket does not keep a connection checked out.
+        await db.release()
 
         while True:
             try:
                 data = await websocket.receive_text()  
                 message_data = json.loads(data) 
 
+                if message_data.get("type") == "read":
+                    read_id = parse_read_receipt(connection, message_data)
+                    if read_id is not None:
+                        read_cursors.mark_read("group", chat_id, user_id, read_id)
+                    continue
+
+                if reject_if_throttled(connection, user_id, ("group", chat_id)):
+                    continue
+
+                created_at = datetime.datetime.utcnow()
+                message_id = await persist_message(connection, Message, {
+                    "chat_id": chat_id,
+                    "sender_id": user_id,
+                    "content": message_data['content'],
+                    "created_at": created_at
+                })
+                if message_id is None:
+                    continue
+
+                message_data['id'] = message_id
+                message_data['sender_id'] = user_id
                 message_data['username'] = user.username
                 message_data['avatar_url'] = user.avatar_url
-
-                new_message = Message(
-                    chat_id=chat_id,
-                    sender_id=user_id,
-                    content=message_data['content'],
-                    created_at=datetime.datetime.utcnow()
-                )
-                db.add(new_message)
-                await db.commit()
+                message_data['created_at'] = created_at.isoformat()
 
                 await manager.broadcast(chat_id, json.dumps(message_data))
+                read_cursors.mark_read("group", chat_id, user_id, message_id)
 
             except asyncio.CancelledError:
                 break
@@ -157,6 +568,7 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token = Depends(get
     except WebSocketDisconnect:
         manager.disconnect(chat_id, websocket)
     except Exception as e:
+        manager.disconnect(chat_id, websocket)
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         raise WebSocketDisconnect(f"Unexpected error: {e}")
 
@@ -186,28 +598,17 @@ async def websocket_private_chat(username: str, websocket: WebSocket, token=Depe
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return  
 
-        logger.info(f"Recipient user {username} found, checking existing chats.")
-
-        chat_query = await db.execute(
-            select(PrivateChat)
-            .filter(
-                ((PrivateChat.user1_id == current_user_id) & (PrivateChat.user2_id == recipient_id)) |
-                ((PrivateChat.user1_id == recipient_id) & (PrivateChat.user2_id == current_user_id))
-            )
-        )
-        private_chat = chat_query.scalar_one_or_none()
+        logger.info(f"Recipient user {username} found, resolving private chat.")
 
-        if not private_chat:
-            logger.info(f"No existing chat found, creating a new private chat.")
-            private_chat = PrivateChat(user1_id=current_user_id, user2_id=recipient_id)
-            db.add(private_chat)
-            await db.commit()
-            await db.refresh(private_chat)
-
-        chat_id = private_chat.id
+        chat_id = await get_or_create_private_chat_id(db, current_user_id, recipient_id)
         logger.info(f"User {token.username} connected to private chat with {username} (Chat ID: {chat_id}).")
         
-        await manager.connect(chat_id, websocket)
+        connection = await private_manager.connect(chat_id, websocket)
+
+        last_seen_id = parse_last_seen_id(websocket)
+        if last_seen_id is not None and not private_manager.replay(chat_id, connection, last_seen_id):
+            await replay_from_db(db, PrivateMessage, chat_id, last_seen_id, connection)
+        await db.release()
 
         while True:
             try:
@@ -215,29 +616,44 @@ async def websocket_private_chat(username: str, websocket: WebSocket, token=Depe
                 logger.info(f"Received message from {token.username}: {data}")
                 message_data = json.loads(data)
 
-                new_message = PrivateMessage(
-                    chat_id=chat_id,
-                    sender_id=current_user_id,
-                    content=message_data['content'],
-                    created_at=datetime.datetime.utcnow()
-                )
-                db.add(new_message)
-                await db.commit()
-
+                if message_data.get("type") == "read":
+                    read_id = parse_read_receipt(connection, message_data)
+                    if read_id is not None:
+                        read_cursors.mark_read("private", chat_id, current_user_id, read_id)
+                    continue
+
+                if reject_if_throttled(connection, current_user_id, ("private", chat_id)):
+                    continue
+
+                created_at = datetime.datetime.utcnow()
+                message_id = await persist_message(connection, PrivateMessage, {
+                    "chat_id": chat_id,
+                    "sender_id": current_user_id,
+                    "content": message_data['content'],
+                    "created_at": created_at
+                })
+                if message_id is None:
+                    continue
+
+                message_data["id"] = message_id
+                message_data["created_at"] = created_at.isoformat()
                 message_data["username"] = token.username
                 message_data["sender_id"] = current_user_id 
                 message_data["avatar_url"] = token.avatar_url
 
-                await manager.broadcast(chat_id, json.dumps(message_data))
+                await private_manager.broadcast(chat_id, json.dumps(message_data))
+                read_cursors.mark_read("private", chat_id, current_user_id, message_id)
             except asyncio.CancelledError:
                 break
 
     except WebSocketDisconnect:
         if chat_id is not None:
             logger.info(f"WebSocket disconnected, removing user {token.username} from chat (Chat ID: {chat_id}).")
-            manager.disconnect(chat_id, websocket)
+            private_manager.disconnect(chat_id, websocket)
     except Exception as e:
         logger.error(f"Error during WebSocket connection: {e}")
+        if chat_id is not None:
+            private_manager.disconnect(chat_id, websocket)
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
 
     
@@ -245,7 +661,7 @@ async def websocket_private_chat(username: str, websocket: WebSocket, token=Depe
 async def get_user_chats(user_id: int, db: AsyncSession = Depends(get_db)):
     try:
         result = await db.execute(
-            select(Chat.id, Chat.is_group, Chat.created_at)
+            select(Chat.id, Chat.is_group, Chat.created_at, Chat.name)
             .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
             .filter(ChatParticipant.user_id == user_id)
         )
@@ -257,6 +673,12 @@ async def get_user_chats(user_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error fetching chats: {str(e)}")
 
 
+@router.get("/chats/inbox")
+async def get_inbox(db: AsyncSession = Depends(get_read_db), current_user: User = Depends(get_current_user_for_id)):
+    result = await db.execute(INBOX_QUERY, {"user_id": current_user.id, "unread_cap": INBOX_UNREAD_CAP})
+    return [dict(row._mapping) for row in result]
+
+
 @router.post("/chats/")
 async def create_chat(
     title: str,  
@@ -281,52 +703,37 @@ async def create_chat(
 
 
 @router.get("/chats/{chat_id}/messages")
-async def get_chat_messages(chat_id: int, db: AsyncSession = Depends(get_db), token = Depends(get_current_user_for_id)):
+async def get_chat_messages(
+    chat_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    token = Depends(get_current_user_for_id),
+    claims = Depends(get_token_claims)
+):
     try:
         if not token:
             raise HTTPException(status_code=400, detail="Token is required")
 
         user_id = token.id
         
-        # Получаем чат и предмет
-        chat_query = await db.execute(
-            select(Chat).filter_by(id=chat_id)
-        )
-        chat = chat_query.scalar_one_or_none()
+        subject_id = await get_chat_subject_id(db, chat_id)
         
-        if not chat:
+        if subject_id is None:
             raise HTTPException(status_code=404, detail="Chat not found")
             
-        subject_query = await db.execute(
-            select(Subject).filter_by(id=chat.subject_id)
-        )
-        subject = subject_query.scalar_one_or_none()
-        
-        is_teacher = subject and subject.teacher_id == user_id
-        
-        if not is_teacher:
-            enrollment_query = await db.execute(
-                select(Enrollment).filter_by(
-                    student_id=user_id,
-                    subject_id=chat.subject_id
-                )
-            )
-            is_student = enrollment_query.scalar_one_or_none() is not None
-            
-            if not is_student:
-                raise HTTPException(status_code=403, detail="Access denied")
+        if not await is_subject_member(db, subject_id, user_id, claims):
+            raise HTTPException(status_code=403, detail="Access denied")
 
-        result = await db.execute(
-            select(Message, User.username, User.avatar_url)
-            .join(User, User.id == Message.sender_id)
-            .filter(Message.chat_id == chat_id)
-            .order_by(Message.created_at)
+        messages, page = await fetch_history_page(
+            db, Message, chat_id, (User.username, User.avatar_url), before, after, limit
         )
-        messages = result.all()
 
         return {
             "user_id": user_id,
-            "subject_id": chat.subject_id,
+            "subject_id": subject_id,
+            **page,
             "messages": [
                 {
                     "id": msg.id,
@@ -339,14 +746,62 @@ async def get_chat_messages(chat_id: int, db: AsyncSession = Depends(get_db), to
                 for msg, username, avatar_url in messages
             ]
         }
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching messages: {e}")
 
 
+@router.get("/chats/{chat_id}/messages/search")
+async def search_group_chat_messages(
+    chat_id: int,
+    q: str = Query(..., min_length=1),
+    cursor: Optional[str] = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_for_id),
+    claims = Depends(get_token_claims)
+):
+    subject_id = await get_chat_subject_id(db, chat_id)
+
+    if subject_id is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    if not await is_subject_member(db, subject_id, current_user.id, claims):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return await search_chat_messages(db, Message, chat_id, q, cursor, limit)
+
+
+@router.get("/user/chat/{username}/messages/search")
+async def search_private_chat_messages(
+    username: str,
+    q: str = Query(..., min_length=1),
+    cursor: Optional[str] = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_for_id)
+):
+    recipient_query = await db.execute(select(User.id).filter_by(username=username))
+    recipient_id = recipient_query.scalar_one_or_none()
+    if recipient_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Searching must not create the conversation as a side effect.
+    chat_id = await get_private_chat_id(db, current_user.id, recipient_id)
+    if chat_id is None:
+        return {"has_more": False, "next_cursor": None, "hits": []}
+
+    return await search_chat_messages(db, PrivateMessage, chat_id, q, cursor, limit)
+
+
 @router.get("/user/chat/{username}/messages")
 async def get_private_chat_messages(
     username: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
     db: AsyncSession = Depends(get_db),
     token=Depends(get_current_user_for_id)
 ):
@@ -363,34 +818,17 @@ async def get_private_chat_messages(
         print(f"Recipient found: {recipient.username}")
 
 
-    chat_query = await db.execute(
-    select(PrivateChat)
-    .filter(
-        ((PrivateChat.user1_id == current_user_id) & (PrivateChat.user2_id == recipient.id)) |
-        ((PrivateChat.user1_id == recipient.id) & (PrivateChat.user2_id == current_user_id))
-    )
-)
-    private_chat = chat_query.scalar_one_or_none()
-
-    if not private_chat:
-        private_chat = PrivateChat(user1_id=current_user_id, user2_id=recipient.id)
-        db.add(private_chat)
-        await db.commit()  
-        await db.refresh(private_chat)
-        print(f"New chat created: {private_chat.id}")
-
-    messages_query = await db.execute(
-        select(PrivateMessage, User.username)
-        .join(User, User.id == PrivateMessage.sender_id)
-        .filter(PrivateMessage.chat_id == private_chat.id)
-        .order_by(PrivateMessage.created_at)
+    chat_id = await get_or_create_private_chat_id(db, current_user_id, recipient.id)
+
+    messages, page = await fetch_history_page(
+        db, PrivateMessage, chat_id, (User.username, User.avatar_url), before, after, limit
     )
-    messages = messages_query.all()
 
     return {
         "user_id": current_user_id,
-        "chat_id": private_chat.id,
+        "chat_id": chat_id,
         "current_username": token.username,
+        **page,
         "messages": [
             {
                 "id": msg.id,
@@ -398,10 +836,8 @@ async def get_private_chat_messages(
                 "username": sender_username, 
                 "content": msg.content,
                 "created_at": msg.created_at,
-                "avatar_url": (await db.execute(
-                    select(User.avatar_url).where(User.id == msg.sender_id)
-                )).scalar_one_or_none()
+                "avatar_url": avatar_url
             }
-            for msg, sender_username in messages
+            for msg, sender_username, avatar_url in messages
         ]
     }
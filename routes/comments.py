@@ -5,7 +5,7 @@ from typing import List
 from subjects import get_all_users_id, users_ids
 import schemas, models
 from sqlalchemy.orm import Session
-from routes.notifications import send_notification
+from routes.notifications import dispatcher, task_audience
 from sqlalchemy.ext.asyncio import AsyncSession
 from security import get_current_user, get_current_user_optional, get_current_user_for_id
 from sqlalchemy import select
@@ -34,17 +34,15 @@ async def create_comment(comment: schemas.CommentCreate, db: AsyncSession = Depe
     await db.commit()
     await db.refresh(db_comment)
 
-    result = await db.execute(select(models.User))
-    all_users = result.scalars().all()
-
-    user_ids = [u.id for u in all_users]
-
-    for user_id in user_ids:
-        await send_notification(
-            user_id=str(user_id),
-            from_user=str(current_user.id),
-            message=f'New comment added to task ID {db_comment.task_id}: {db_comment.content}'
-        )
+    dispatcher.notify_event(
+        "comment",
+        db_comment.task_id,
+        task_audience(db_comment.task_id),
+        from_user=current_user.id,
+        content=f'New comment added to task ID {db_comment.task_id}: {db_comment.content}',
+        summary=f'{{count}} new comments on task ID {db_comment.task_id}',
+        exclude_authors=True
+    )
     redirect_url = f"/tasks/{db_comment.task_id}?message=Comment successfully created!"
     return RedirectResponse(url=redirect_url, status_code=303)
 
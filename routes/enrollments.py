@@ -2,12 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status, Form, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_
 import models
-from database import get_db
+from database import get_db, get_read_db
 from routes.tasks import templates
-from security import get_current_user, get_current_user_for_id
+from security import get_current_user, get_current_user_for_id, bump_claims_version, invalidate_claims, create_user_token, set_access_cookie
 from fastapi.responses import RedirectResponse
 from typing import List
 import schemas
+from membership import invalidate_subject
 
 
 router = APIRouter(prefix="/enrollments", tags=["enrollments"])
@@ -55,9 +56,15 @@ async def enroll_in_subject(
             chat_participant = models.ChatParticipant(chat_id=chat.id, user_id=user.id)
             db.add(chat_participant)
 
+    await bump_claims_version(db, [user.id])
     await db.commit()
+    await invalidate_subject(subject.id)
+    await invalidate_claims([user.id])
 
-    return RedirectResponse(url="/", status_code=303)
+    response = RedirectResponse(url="/", status_code=303)
+    # Reissued so the new enrollment is in the token's claims immediately.
+    set_access_cookie(response, await create_user_token(db, user))
+    return response
 
 
 
@@ -82,7 +89,7 @@ async def get_enrolled_subjects(
 async def search_courses(
     request: Request, 
     query: str, 
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     teacher_result = await db.execute(
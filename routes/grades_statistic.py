@@ -4,7 +4,7 @@ from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from database import get_db
+from database import get_db, get_read_db
 from security import get_current_user_for_id
 import models
 from datetime import datetime
@@ -16,7 +16,7 @@ templates = Jinja2Templates(directory="templates")
 async def get_statistics(
     subject_id: int,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     result = await db.execute(
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+
+import models
+from metrics import metrics
+from security import get_admin_user
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/")
+async def get_metrics(current_user: models.User = Depends(get_admin_user)):
+    return metrics.snapshot()
@@ -1,11 +1,53 @@
 from urllib import request
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Request, Depends, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Hashable, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import resource
+import time
+from collections import Counter
+
+from sqlalchemy import select, union, insert, update, literal, Integer, Text, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from database import AsyncSessionLocal, get_db, get_read_db
+from models import Enrollment, Subject, Task, User, Notification
+from metrics import metrics
+from cache import MISSING
+from realtime import broker, QueuedConnection
+from security import get_admin_user, get_current_user_for_id
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "10000"))
+NOTIFICATION_COALESCE_WINDOW = float(os.getenv("NOTIFICATION_COALESCE_WINDOW", "5"))
+NOTIFICATION_DIGEST_INTERVAL = float(os.getenv("NOTIFICATION_DIGEST_INTERVAL", "900"))
+# Optional: comma-separated low-priority kinds (e.g. "comment") held back and delivered as
+# one digest per interval. Empty by default, so every kind only waits the coalesce window.
+NOTIFICATION_DIGEST_KINDS = {kind for kind in os.getenv("NOTIFICATION_DIGEST_KINDS", "").split(",") if kind}
+NOTIFICATION_PAGE_SIZE = 20
+NOTIFICATION_MAX_PAGE_SIZE = 100
+NOTIFICATION_REPLAY_LIMIT = int(os.getenv("NOTIFICATION_REPLAY_LIMIT", "100"))
+NOTIFICATION_PING_INTERVAL = float(os.getenv("NOTIFICATION_PING_INTERVAL", "25"))
+# A socket that has not answered (or sent anything) for this long is treated as dead.
+NOTIFICATION_IDLE_TIMEOUT = float(os.getenv("NOTIFICATION_IDLE_TIMEOUT", "75"))
+NOTIFICATION_SEND_TIMEOUT = float(os.getenv("NOTIFICATION_SEND_TIMEOUT", "10"))
+NOTIFICATION_SEND_QUEUE_SIZE = int(os.getenv("NOTIFICATION_SEND_QUEUE_SIZE", "256"))
+NOTIFICATION_SSE_KEEPALIVE = float(os.getenv("NOTIFICATION_SSE_KEEPALIVE", "15"))
+NOTIFICATION_SSE_QUEUE_SIZE = int(os.getenv("NOTIFICATION_SSE_QUEUE_SIZE", "256"))
+NOTIFICATION_SSE_RETRY_MS = 3000
+
+# Broker key for payloads addressed to a list of users rather than a single one.
+BATCH_KEY = "*"
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 templates = Jinja2Templates(directory="templates")
@@ -20,55 +62,518 @@ class Message(BaseModel):
     person_from: str
     person_to: str
     text: MessageText
+    content: str = ""
     date_sent: datetime = datetime.now()
 
 
+class MarkRead(BaseModel):
+    ids: Optional[List[int]] = None
+    up_to_id: Optional[int] = None
+
+
+def notification_message(notification_id: int, user_id: int, sender_id: Optional[int], content: str, created_at: datetime) -> Message:
+    return Message(
+        id=notification_id,
+        person_from=str(sender_id) if sender_id is not None else "",
+        person_to=str(user_id),
+        text=MessageText(id=notification_id, time_sent=created_at.strftime("%H:%M")),
+        content=content,
+        date_sent=created_at
+    )
+
+
+class NotificationConnection(QueuedConnection):
+    transport = "websocket"
+    # Whether the sweeper pings it and expects a pong back.
+    heartbeat = True
+    queue_size = NOTIFICATION_SEND_QUEUE_SIZE
+
+    def __init__(self, websocket: Optional[WebSocket], user_id: str):
+        super().__init__(websocket, queue_size=self.queue_size, send_timeout=NOTIFICATION_SEND_TIMEOUT)
+        self.user_id = user_id
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+
+class SSEConnection(NotificationConnection):
+    transport = "sse"
+    # Liveness comes from the stream's own keep-alive writes instead.
+    heartbeat = False
+    queue_size = NOTIFICATION_SSE_QUEUE_SIZE
+
+    def __init__(self, user_id: str):
+        # The response generator drains the queue, so there is no writer task to start.
+        super().__init__(None, user_id)
+
+    def enqueue(self, payload: str) -> bool:
+        event_id = json.loads(payload).get("id")
+        return super().enqueue(f"id: {event_id}\ndata: {payload}\n\n")
+
+    async def _close(self, reason: str):
+        # Ends the stream; EventSource reconnects and resumes from its last event id.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.active_connections: Dict[str, List[NotificationConnection]] = {}
+        self.sweeper_task = None
+        broker.subscribe(channel, self.deliver)
+        metrics.register_gauge(f"{channel}_connections", self.stats)
+
+    async def start(self):
+        self.sweeper_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self.sweeper_task:
+            self.sweeper_task.cancel()
+            self.sweeper_task = None
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def connect(self, websocket: WebSocket, user_id: str) -> NotificationConnection:
         await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        connection = self.register(NotificationConnection(websocket, user_id))
+        connection.start()
+        return connection
+
+    def register(self, connection: NotificationConnection) -> NotificationConnection:
+        connection.on_evict = self._remove
+        self.active_connections.setdefault(connection.user_id, []).append(connection)
+        return connection
+
+    def disconnect(self, connection: NotificationConnection):
+        self._remove(connection)
+        connection.stop()
 
-    def disconnect(self, websocket: WebSocket, user_id: str):
-        if user_id in self.active_connections:
-            self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
+    def _remove(self, connection: NotificationConnection):
+        connections = self.active_connections.get(connection.user_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.user_id]
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def stats(self):
+        connections = self.connection_count()
+        by_transport = {"websocket": 0, "sse": 0}
+        for user_connections in self.active_connections.values():
+            for connection in user_connections:
+                by_transport[connection.transport] += 1
+        rss = current_rss_bytes()
+        # Per-transport memory is measured by loading one transport at a time and comparing these.
+        return {
+            "connections": connections,
+            "by_transport": by_transport,
+            "users": len(self.active_connections),
+            "rss_bytes": rss,
+            "rss_bytes_per_connection": rss // connections if connections else None
+        }
+
+    async def _sweep_loop(self):
+        # Pings every socket and reaps the ones whose peer has gone quiet, e.g. half-open
+        # connections from machines that went to sleep.
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(NOTIFICATION_PING_INTERVAL)
+            deadline = time.monotonic() - NOTIFICATION_IDLE_TIMEOUT
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections):
+                    if not connection.heartbeat:
+                        continue
+                    if connection.last_seen < deadline:
+                        connection.evict("heartbeat timeout")
+                    else:
+                        connection.enqueue(ping)
 
     async def send_message(self, message: Message):
-        if message.person_to in self.active_connections:
-            for connection in self.active_connections[message.person_to]:
-                await connection.send_json(message.dict())
+        # Published through the broker so the recipient is reached on whichever worker holds the socket.
+        await broker.publish(self.channel, message.person_to, json.dumps(message.model_dump(mode="json")))
+
+    async def send_batch(self, recipients, message: Message):
+        # One broker message per batch of (notification id, user id) rows; the id and
+        # person_to are filled in per recipient on delivery.
+        await broker.publish(self.channel, BATCH_KEY, json.dumps({
+            "to": [[notification_id, str(user_id)] for notification_id, user_id in recipients],
+            "message": message.model_dump(mode="json")
+        }))
+
+    async def deliver(self, user_id: str, payload: str):
+        # Only enqueues: each connection's writer task does the actual send, so a stalled
+        # socket cannot hold up the broker (chat delivery included).
+        if user_id == BATCH_KEY:
+            batch = json.loads(payload)
+            message = batch["message"]
+            for notification_id, recipient in batch["to"]:
+                if recipient in self.active_connections:
+                    self._send(recipient, json.dumps({
+                        **message,
+                        "id": notification_id,
+                        "person_to": recipient,
+                        "text": {**message["text"], "id": notification_id}
+                    }))
+            return
+        self._send(user_id, payload)
+
+    def _send(self, user_id: str, payload: str):
+        # A full queue evicts the connection; the client reconnects and replays from its cursor.
+        for connection in list(self.active_connections.get(user_id, [])):
+            connection.enqueue(payload)
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Peak rather than current RSS, in kilobytes on Linux and bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+manager = ConnectionManager("notifications")
+
+
+# Audiences are selects of a single user_id column, resolved on the dispatcher worker.
+def user_audience(user_id: int) -> Select:
+    return select(User.id.label("user_id")).where(User.id == user_id)
+
+
+def subject_students_audience(subject_id: int) -> Select:
+    return select(Enrollment.student_id.label("user_id")).where(Enrollment.subject_id == subject_id)
+
+
+def new_course_audience(subject_id: int, teacher_id: int) -> Select:
+    # Students already taking one of the teacher's other courses.
+    return (
+        select(Enrollment.student_id.label("user_id"))
+        .join(Subject, Subject.id == Enrollment.subject_id)
+        .where(Subject.teacher_id == teacher_id, Subject.id != subject_id)
+        .distinct()
+    )
+
+
+def task_audience(task_id: int) -> Select:
+    # Everyone in the task's course: its enrolled students and its teacher.
+    members = union(
+        select(Enrollment.student_id.label("user_id"))
+        .join(Task, Task.subject_id == Enrollment.subject_id)
+        .where(Task.id == task_id),
+        select(Subject.teacher_id.label("user_id"))
+        .join(Task, Task.subject_id == Subject.id)
+        .where(Task.id == task_id)
+    ).subquery()
+    return select(members.c.user_id)
+
+
+def audience_only(audience: Select, user_id: int) -> Select:
+    members = audience.subquery()
+    return select(members.c.user_id).where(members.c.user_id == user_id)
 
 
-manager = ConnectionManager()
+def audience_without(audience: Select, user_ids) -> Select:
+    members = audience.subquery()
+    return select(members.c.user_id).where(members.c.user_id.not_in(list(user_ids)))
 
 
-@router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+class PendingEvent:
+    __slots__ = ("audience", "summary", "exclude_authors", "authors", "contents", "timer")
+
+    def __init__(self, audience: Select, summary: str, exclude_authors: bool):
+        self.audience = audience
+        self.summary = summary
+        self.exclude_authors = exclude_authors
+        # from_user -> number of merged events and the latest content they sent
+        self.authors: Counter = Counter()
+        self.contents: Dict[Optional[int], str] = {}
+        self.timer = None
+
+    def add(self, from_user: Optional[int], content: str):
+        self.authors[from_user] += 1
+        self.contents[from_user] = content
+
+    def render(self, skip_author=MISSING):
+        # (sender, content) for a recipient who did not write skip_author's events, or None.
+        authors = {author: count for author, count in self.authors.items() if author != skip_author}
+        count = sum(authors.values())
+        if not count:
+            return None
+        sender = next(iter(authors)) if len(authors) == 1 else None
+        if count == 1:
+            return sender, self.contents[sender]
+        return sender, self.summary.format(count=count)
+
+
+class NotificationDispatcher:
+    def __init__(self, batch_size: int = NOTIFICATION_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+        self.pending: Dict[Tuple[str, Hashable], PendingEvent] = {}
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for event_key in list(self.pending):
+            self._flush_event(event_key)
+        if self.task:
+            self.queue.put_nowait(None)
+            await self.task
+            self.task = None
+
+    def notify(self, audience: Select, from_user: Optional[int], content: str):
+        # Only enqueues: resolving the audience, storing and delivery happen on the worker.
+        try:
+            self.queue.put_nowait((audience, from_user, content))
+        except asyncio.QueueFull:
+            logger.error(f"Notification queue full, dropping notification from user {from_user}")
+
+    def notify_event(
+        self,
+        kind: str,
+        key: Hashable,
+        audience: Select,
+        from_user: Optional[int],
+        content: str,
+        summary: str,
+        exclude_authors: bool = False
+    ):
+        # Events of one kind for the same key (and therefore the same audience) are merged
+        # for a short window; summary is formatted with {count} when more than one arrived.
+        # With exclude_authors, nobody is told about their own events: who gets what is
+        # worked out from all merged events when the window closes.
+        event_key = (kind, key)
+        event = self.pending.get(event_key)
+        if event is None:
+            event = self.pending[event_key] = PendingEvent(audience, summary, exclude_authors)
+            window = NOTIFICATION_DIGEST_INTERVAL if kind in NOTIFICATION_DIGEST_KINDS else NOTIFICATION_COALESCE_WINDOW
+            event.timer = asyncio.get_running_loop().call_later(window, self._flush_event, event_key)
+        else:
+            metrics.increment("notifications_coalesced", kind)
+        event.add(from_user, content)
+
+    def _flush_event(self, event_key: Tuple[str, Hashable]):
+        event = self.pending.pop(event_key, None)
+        if event is None:
+            return
+        event.timer.cancel()
+
+        if not event.exclude_authors:
+            self.notify(event.audience, *event.render())
+            return
+
+        authors = [author for author in event.authors if author is not None]
+        self.notify(audience_without(event.audience, authors), *event.render())
+        # Each author hears only about the others' events, if there were any.
+        for author in authors:
+            rendered = event.render(skip_author=author)
+            if rendered is not None:
+                self.notify(audience_only(event.audience, author), *rendered)
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                return
+            try:
+                await self._dispatch(*job)
+            except Exception as e:
+                logger.error(f"Failed to dispatch notification: {e}")
+
+    async def _dispatch(self, audience: Select, from_user: Optional[int], content: str):
+        created_at = datetime.utcnow()
+        recipients = audience.subquery()
+        # One INSERT ... SELECT writes the whole fan-out, so offline users find it in their inbox.
+        stmt = (
+            insert(Notification)
+            .from_select(
+                ["user_id", "sender_id", "content", "created_at"],
+                select(
+                    recipients.c.user_id,
+                    literal(from_user, Integer),
+                    literal(content, Text),
+                    literal(created_at, DateTime)
+                )
+            )
+            .returning(Notification.id, Notification.user_id)
+        )
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(stmt)
+            rows = result.all()
+            await session.commit()
+
+        message = notification_message(0, 0, from_user, content, created_at)
+        for start in range(0, len(rows), self.batch_size):
+            await manager.send_batch(rows[start:start + self.batch_size], message)
+
+
+dispatcher = NotificationDispatcher()
+
+
+@router.websocket("/ws")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    since: int = 0,
+    current_user: User = Depends(get_current_user_for_id),
+    db: AsyncSession = Depends(get_db)
+):
+    # The user comes from the access-token cookie; the session is only needed for that lookup.
+    user_id = str(current_user.id)
+    await db.release()
+
+    connection = await manager.connect(websocket, user_id)
     try:
+        await send_unread(connection, current_user.id, since)
         while True:
             await websocket.receive_text()
+            # Pongs and any other frame count as proof of life.
+            connection.touch()
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
+        manager.disconnect(connection)
+    except Exception as e:
+        connection.evict(str(e))
 
 
-async def send_notification(user_id: str, from_user: str, message: str):
-    msg = Message(
-        id=len(manager.active_connections),
-        person_from=from_user,
-        person_to=user_id,
-        text=MessageText(
-            id=len(manager.active_connections),
-            time_sent=datetime.now().strftime("%H:%M")
+@router.get("/stream")
+async def notification_stream(
+    request: Request,
+    since: int = 0,
+    current_user: User = Depends(get_current_user_for_id),
+    db: AsyncSession = Depends(get_db)
+):
+    await db.release()
+
+    # EventSource resends the id of the last event it saw when it reconnects.
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+
+    connection = manager.register(SSEConnection(str(current_user.id)))
+    try:
+        await send_unread(connection, current_user.id, since)
+    except Exception:
+        manager.disconnect(connection)
+        raise
+
+    async def events():
+        try:
+            yield f"retry: {NOTIFICATION_SSE_RETRY_MS}\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(connection.queue.get(), NOTIFICATION_SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            manager.disconnect(connection)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/stats")
+async def get_notification_stats(current_user: User = Depends(get_admin_user)):
+    return manager.stats()
+
+
+async def send_unread(connection: NotificationConnection, user_id: int, since: int):
+    # Catches up a (re)connecting client on unread notifications newer than its cursor.
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Notification)
+            .where(
+                Notification.user_id == user_id,
+                Notification.read_at.is_(None),
+                Notification.id > since
+            )
+            .order_by(Notification.id.desc())
+            .limit(NOTIFICATION_REPLAY_LIMIT)
+        )
+        notifications = result.scalars().all()
+
+    for notification in reversed(notifications):
+        message = notification_message(
+            notification.id, notification.user_id, notification.sender_id,
+            notification.content, notification.created_at
         )
+        connection.enqueue(json.dumps(message.model_dump(mode="json")))
+
+
+@router.get("/")
+async def get_notifications(
+    before: Optional[int] = None,
+    limit: int = Query(NOTIFICATION_PAGE_SIZE, ge=1, le=NOTIFICATION_MAX_PAGE_SIZE),
+    unread: bool = False,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_for_id)
+):
+    query = select(Notification).where(Notification.user_id == current_user.id)
+    if unread:
+        query = query.where(Notification.read_at.is_(None))
+    if before is not None:
+        query = query.where(Notification.id < before)
+
+    result = await db.execute(query.order_by(Notification.id.desc()).limit(limit + 1))
+    notifications = result.scalars().all()
+    has_more = len(notifications) > limit
+    notifications = notifications[:limit]
+
+    return {
+        "items": [
+            {
+                "id": notification.id,
+                "sender_id": notification.sender_id,
+                "content": notification.content,
+                "created_at": notification.created_at.isoformat(),
+                "read": notification.read_at is not None
+            }
+            for notification in notifications
+        ],
+        "next_cursor": notifications[-1].id if has_more else None
+    }
+
+
+@router.post("/read")
+async def mark_notifications_read(
+    body: MarkRead,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user_for_id)
+):
+    query = (
+        update(Notification)
+        .where(Notification.user_id == current_user.id, Notification.read_at.is_(None))
+        .values(read_at=datetime.utcnow())
+    )
+    if body.ids is not None:
+        query = query.where(Notification.id.in_(body.ids))
+    if body.up_to_id is not None:
+        query = query.where(Notification.id <= body.up_to_id)
+
+    result = await db.execute(query)
+    await db.commit()
+    return {"updated": result.rowcount}
+
+
+async def send_notification(user_id: str, from_user: str, message: str):
+    dispatcher.notify(
+        user_audience(int(user_id)),
+        from_user=int(from_user) if from_user else None,
+        content=message
     )
-    await manager.send_message(msg)
 
     redirect_url = f"/create?message={message}?request={Request}"
 
@@ -5,14 +5,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy import select, text
 import models, schemas, security
-from database import get_db
+from database import get_db, get_read_db
 from security import get_current_user, get_current_user_optional, get_current_user_for_id
 import uuid
 from typing import List
 from .chats import create_chat
+from membership import is_subject_member, invalidate_subject
 import logging
 
-from routes.notifications import send_notification
+from routes.notifications import dispatcher, new_course_audience
 
 router = APIRouter(prefix="/subjects", tags=["subjects"])
 templates = Jinja2Templates(directory="templates")
@@ -92,7 +93,7 @@ async def create_subject_page(request: Request, message: str = None):
 async def get_subject(
     subject_id: int,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     result = await db.execute(
@@ -180,20 +181,22 @@ async def create_subject(
 
     chat_participant = models.ChatParticipant(chat_id=default_chat.id, user_id=user.id)
     db.add(chat_participant)
+    await security.bump_claims_version(db, [user.id])
     await db.commit()
+    await security.invalidate_claims([user.id])
     print(f"Added user {user.id} as a participant of chat {default_chat.id}")
 
-    result = await db.execute(select(models.User))
-    all_users = result.scalars().all()
-
-    user_ids = [u.id for u in all_users]
-
-    for user_id in user_ids:
-        await send_notification(user_id=str(user_id), from_user=str(user.id),
-                                message=f'Created a new course: {db_subject.title}')
+    dispatcher.notify(
+        new_course_audience(db_subject.id, user.id),
+        from_user=user.id,
+        content=f'Created a new course: {db_subject.title}'
+    )
 
     redirect_url = f"/subjects/create?message=Subject successfully created!"
-    return RedirectResponse(url=redirect_url, status_code=303)
+    response = RedirectResponse(url=redirect_url, status_code=303)
+    # The teacher's token gains the new subject right away.
+    security.set_access_cookie(response, await security.create_user_token(db, user))
+    return response
 
 
 
@@ -203,24 +206,13 @@ async def get_subject_participants(
     subject_id: int,
     request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user_for_id)
+    current_user: models.User = Depends(security.get_current_user_for_id),
+    claims = Depends(security.get_token_claims)
 ):
     if not current_user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    enrollment_query = await db.execute(
-        select(models.Enrollment)
-        .filter_by(student_id=current_user.id, subject_id=subject_id)
-    )
-    enrollment = enrollment_query.scalar_one_or_none()
-
-    teacher_query = await db.execute(
-        select(models.Subject)
-        .filter_by(teacher_id=current_user.id, id=subject_id)
-    )
-    teacher = teacher_query.scalar_one_or_none()
-
-    if not enrollment and not teacher:
+    if not await is_subject_member(db, subject_id, current_user.id, claims):
         raise HTTPException(status_code=403, detail="Access denied")
 
     result = await db.execute(
@@ -269,7 +261,7 @@ async def get_subject_participants(
 async def get_subject_statistics(
     subject_id: int,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     result = await db.execute(
@@ -310,19 +302,20 @@ async def get_subject_statistics(
 async def update_access_code(
     subject_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    claims = Depends(security.get_token_claims)
 ):
-    result = await db.execute(select(models.User).filter(models.User.email == current_user))
-    user = result.scalar_one_or_none()
-    
     result = await db.execute(select(models.Subject).filter(models.Subject.id == subject_id))
     subject = result.scalar_one_or_none()
     
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
     
-    if subject.teacher_id != user.id:
-        raise HTTPException(status_code=403, detail="Only the teacher can update access code")
+    # Fresh claims identify the teacher without looking the caller up.
+    if not (claims and claims.is_teacher(subject_id)):
+        result = await db.execute(select(models.User.id).filter(models.User.email == current_user))
+        if subject.teacher_id != result.scalar_one_or_none():
+            raise HTTPException(status_code=403, detail="Only the teacher can update access code")
     
     new_access_code = str(uuid.uuid4())[:8]
     subject.access_code = new_access_code
@@ -335,19 +328,20 @@ async def update_access_code(
 async def disable_access_code(
     subject_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    claims = Depends(security.get_token_claims)
 ):
-    result = await db.execute(select(models.User).filter(models.User.email == current_user))
-    user = result.scalar_one_or_none()
-    
     result = await db.execute(select(models.Subject).filter(models.Subject.id == subject_id))
     subject = result.scalar_one_or_none()
     
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
     
-    if subject.teacher_id != user.id:
-        raise HTTPException(status_code=403, detail="Only the teacher can disable access code")
+    # Fresh claims identify the teacher without looking the caller up.
+    if not (claims and claims.is_teacher(subject_id)):
+        result = await db.execute(select(models.User.id).filter(models.User.email == current_user))
+        if subject.teacher_id != result.scalar_one_or_none():
+            raise HTTPException(status_code=403, detail="Only the teacher can disable access code")
     
     subject.access_code = None
     await db.commit()
@@ -414,6 +408,10 @@ async def delete_course(
             text("DELETE FROM messages WHERE chat_id = :chat_id"),
             {"chat_id": chat.id}
         )
+        await db.execute(
+            text("DELETE FROM messages_archive WHERE chat_id = :chat_id"),
+            {"chat_id": chat.id}
+        )
         await db.execute(
             text("DELETE FROM chat_participants WHERE chat_id = :chat_id"),
             {"chat_id": chat.id}
@@ -423,6 +421,12 @@ async def delete_course(
             {"subject_id": subject_id}
         )
     
+    result = await db.execute(
+        select(models.Enrollment.student_id).filter(models.Enrollment.subject_id == subject_id)
+    )
+    affected_user_ids = [subject.teacher_id, *result.scalars().all()]
+    await security.bump_claims_version(db, affected_user_ids)
+
     await db.execute(
         text("DELETE FROM enrollments WHERE subject_id = :subject_id"),
         {"subject_id": subject_id}
@@ -434,8 +438,12 @@ async def delete_course(
     )
     
     await db.commit()
+    await invalidate_subject(subject_id)
+    await security.invalidate_claims(affected_user_ids)
     
-    return RedirectResponse(
+    response = RedirectResponse(
         url="/", 
         status_code=303
     )
+    security.set_access_cookie(response, await security.create_user_token(db, current_user))
+    return response
@@ -14,7 +14,9 @@ from sqlalchemy.orm import selectinload, joinedload
 
 import models, schemas
 from database import get_db
-from security import get_current_user_for_id
+from security import get_current_user_for_id, get_token_claims
+from membership import get_subject_members, is_subject_teacher
+from routes.notifications import dispatcher, subject_students_audience, user_audience
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 templates = Jinja2Templates(directory="templates")
@@ -87,6 +89,15 @@ async def create_task(
     )
     db.add(task)
     await db.commit()
+
+    dispatcher.notify_event(
+        "task_created",
+        subject_id,
+        subject_students_audience(subject_id),
+        from_user=current_user.id,
+        content=f'New task in {subject.title}: {title}',
+        summary=f'{{count}} new tasks in {subject.title}'
+    )
     
     return RedirectResponse(url=f"/subjects/{subject_id}", status_code=303)
 
@@ -174,25 +185,16 @@ async def get_homework(
 async def get_subject_tasks(
         subject_id: int,
         db: AsyncSession = Depends(get_db),
-        current_user: str = Depends(get_current_user_for_id)
+        current_user: models.User = Depends(get_current_user_for_id),
+        claims = Depends(get_token_claims)
 ):
-    result = await db.execute(select(models.User).filter(models.User.email == current_user))
-    user = result.scalar_one_or_none()
+    if not (claims and claims.user_id == current_user.id and claims.is_member(subject_id)):
+        members = await get_subject_members(db, subject_id)
 
-    result = await db.execute(select(models.Subject).filter(models.Subject.id == subject_id))
-    subject = result.scalar_one_or_none()
+        if not members:
+            raise HTTPException(status_code=404, detail="Subject not found")
 
-    if not subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-
-    if subject.teacher_id != user.id:
-        result = await db.execute(
-            select(models.Enrollment).filter(
-                models.Enrollment.student_id == user.id,
-                models.Enrollment.subject_id == subject_id
-            )
-        )
-        if not result.scalar_one_or_none():
+        if not members.includes(current_user.id):
             raise HTTPException(status_code=403, detail="Access denied")
 
     result = await db.execute(select(models.Task).filter(models.Task.subject_id == subject_id))
@@ -201,12 +203,15 @@ async def get_subject_tasks(
 
 @router.get("/homeworks")
 async def homework_page(request: Request, db: AsyncSession = Depends(get_db),
-                        current_user: models.User = Depends(get_current_user_for_id)):
-    stmt = select(models.Enrollment).where(models.Enrollment.student_id == current_user.id)
-    result = await db.execute(stmt)
-    enrollments = result.scalars().all()
-
-    enrolled_subject_ids = [enrollment.subject_id for enrollment in enrollments]
+                        current_user: models.User = Depends(get_current_user_for_id),
+                        claims = Depends(get_token_claims)):
+    if claims and claims.user_id == current_user.id:
+        # Fresh claims list every enrollment, so the lookup can be skipped.
+        enrolled_subject_ids = list(claims.enrolled)
+    else:
+        stmt = select(models.Enrollment.subject_id).where(models.Enrollment.student_id == current_user.id)
+        result = await db.execute(stmt)
+        enrolled_subject_ids = result.scalars().all()
 
     current_time = datetime.now()
 
@@ -225,11 +230,11 @@ async def edit_task_form(
     task_id: int,
     request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user_for_id)
+    current_user: models.User = Depends(get_current_user_for_id),
+    claims = Depends(get_token_claims)
 ):
     result = await db.execute(
         select(models.Task)
-        .options(selectinload(models.Task.subject))
         .where(models.Task.id == task_id)
     )
     task = result.scalar_one_or_none()
@@ -237,7 +242,7 @@ async def edit_task_form(
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if task.subject.teacher_id != current_user.id:
+    if not await is_subject_teacher(db, task.subject_id, current_user.id, claims):
         raise HTTPException(status_code=403, detail="Not authorized to edit this task")
 
     return templates.TemplateResponse(
@@ -257,12 +262,12 @@ async def update_task(
     deadline: datetime = Form(...),
     max_grade: int = Form(...),
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user_for_id)
+    current_user: models.User = Depends(get_current_user_for_id),
+    claims = Depends(get_token_claims)
 ):
     try:
         result = await db.execute(
             select(models.Task)
-            .options(selectinload(models.Task.subject))
             .where(models.Task.id == task_id)
         )
         task = result.scalar_one_or_none()
@@ -270,7 +275,7 @@ async def update_task(
         if not task:
             raise HTTPException(status_code=404, detail="Task not found")
 
-        if task.subject.teacher_id != current_user.id:
+        if not await is_subject_teacher(db, task.subject_id, current_user.id, claims):
             raise HTTPException(status_code=403, detail="Not authorized to edit this task")
 
         task.title = title
@@ -290,11 +295,11 @@ async def confirm_delete_task(
     task_id: int,
     request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user_for_id)
+    current_user: models.User = Depends(get_current_user_for_id),
+    claims = Depends(get_token_claims)
 ):
     result = await db.execute(
         select(models.Task)
-        .options(selectinload(models.Task.subject))
         .where(models.Task.id == task_id)
     )
     task = result.scalar_one_or_none()
@@ -302,7 +307,7 @@ async def confirm_delete_task(
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if task.subject.teacher_id != current_user.id:
+    if not await is_subject_teacher(db, task.subject_id, current_user.id, claims):
         raise HTTPException(status_code=403, detail="Not authorized to delete this task")
 
     return templates.TemplateResponse(
@@ -318,12 +323,12 @@ async def confirm_delete_task(
 async def delete_task(
     task_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user_for_id)
+    current_user: models.User = Depends(get_current_user_for_id),
+    claims = Depends(get_token_claims)
 ):
     try:
         result = await db.execute(
             select(models.Task)
-            .options(selectinload(models.Task.subject))
             .where(models.Task.id == task_id)
         )
         task = result.scalar_one_or_none()
@@ -331,7 +336,7 @@ async def delete_task(
         if not task:
             raise HTTPException(status_code=404, detail="Task not found")
 
-        if task.subject.teacher_id != current_user.id:
+        if not await is_subject_teacher(db, task.subject_id, current_user.id, claims):
             raise HTTPException(status_code=403, detail="Not authorized to delete this task")
 
         subject_id = task.subject_id
@@ -405,11 +410,22 @@ async def upload_solution(
     
     try:
         await db.commit()
-        return RedirectResponse(url=f"/tasks/task/{task_id}", status_code=303)
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+    members = await get_subject_members(db, task.subject_id)
+    if members:
+        dispatcher.notify_event(
+            "submission",
+            task_id,
+            user_audience(members.teacher_id),
+            from_user=current_user.id,
+            content=f'New submission for {task.title} from {current_user.username}',
+            summary=f'{{count}} new submissions for {task.title}'
+        )
+    return RedirectResponse(url=f"/tasks/task/{task_id}", status_code=303)
+
 @router.get("/uploads/{file_path:path}")
 async def get_upload(file_path: str):
     return FileResponse(f"{UPLOAD_DIR}/{file_path}")
@@ -8,7 +8,7 @@ import os
 from datetime import datetime
 import models
 from database import get_db
-from security import verify_password, get_password_hash, get_current_user_for_id
+from security import verify_password, get_password_hash, get_current_user_for_id, invalidate_principal, load_hashed_password
 import logging
 from fastapi.responses import RedirectResponse
 
@@ -59,6 +59,7 @@ async def update_profile(
                         .values(avatar_url=avatar_url)
                     )
                     await db.commit()
+                    await invalidate_principal(current_user.email)
                     
                     result = await db.execute(
                         select(models.User).filter(models.User.id == current_user.id)
@@ -95,10 +96,11 @@ async def change_password(
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     try:
-        if not verify_password(current_password, current_user.hashed_password):
+        hashed_password = await load_hashed_password(db, current_user.id)
+        if not await verify_password(current_password, hashed_password):
             raise HTTPException(status_code=400, detail="Current password is incorrect")
         
-        new_hashed_password = get_password_hash(new_password)
+        new_hashed_password = await get_password_hash(new_password)
         
         await db.execute(
             update(models.User)
@@ -107,6 +109,7 @@ async def change_password(
         )
         
         await db.commit()
+        await invalidate_principal(current_user.email)
         
         logger.info(f"Password updated successfully for user {current_user.username}")
         
@@ -129,7 +132,8 @@ async def update_username(
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     try:
-        if not verify_password(current_password, current_user.hashed_password):
+        hashed_password = await load_hashed_password(db, current_user.id)
+        if not await verify_password(current_password, hashed_password):
             raise HTTPException(status_code=400, detail="Current password is incorrect")
         
         existing_user = await db.execute(
@@ -150,6 +154,7 @@ async def update_username(
         )
         
         await db.commit()
+        await invalidate_principal(current_user.email)
         
         logger.info(f"Username updated successfully from {old_username} to {username}")
         
@@ -172,7 +177,8 @@ async def update_email(
     current_user: models.User = Depends(get_current_user_for_id)
 ):
     try:
-        if not verify_password(current_password, current_user.hashed_password):
+        hashed_password = await load_hashed_password(db, current_user.id)
+        if not await verify_password(current_password, hashed_password):
             raise HTTPException(status_code=400, detail="Current password is incorrect")
         
         old_email = current_user.email
@@ -184,6 +190,8 @@ async def update_email(
         )
         
         await db.commit()
+        await invalidate_principal(old_email)
+        await invalidate_principal(email)
         
         logger.info(f"Email updated successfully from {old_email} to {email}")
         
@@ -230,6 +238,7 @@ async def update_avatar(
                 .values(avatar_url=avatar_url)
             )
             await db.commit()
+            await invalidate_principal(current_user.email)
             
             result = await db.execute(
                 select(models.User).filter(models.User.id == current_user.id)
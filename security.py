@@ -1,33 +1,106 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import FrozenSet, Iterable, NamedTuple, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status, Cookie, WebSocket
+from fastapi import Depends, HTTPException, status, Cookie, WebSocket, Response
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
+from cache import TTLCache
 from database import get_db
-from models import User
+from metrics import metrics
+from models import User, Subject, Enrollment
+from realtime import broker
 
 logger = logging.getLogger(__name__)
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300 * 60
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash/verify calls allowed to wait for a worker before new ones are turned away with 503.
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+CLAIMS_VERSION_CACHE_TTL = float(os.getenv("CLAIMS_VERSION_CACHE_TTL", "60"))
+# Comma-separated emails allowed to read operational endpoints (/metrics, /notifications/stats).
+ADMIN_EMAILS = {email.strip() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost than BCRYPT_ROUNDS count as outdated and are
+# replaced on the next successful login.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_jobs = 0
+metrics.register_gauge("password_hash_jobs", lambda: password_jobs)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Column values of authenticated users keyed by token subject (email). Each hit builds a
+# fresh, session-less User so requests never share an instance.
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+metrics.register_gauge("principal_cache", principal_cache.stats)
+# The password hash is left out: it has no business sitting in a shared cache, and the routes
+# that check the current password read it with load_hashed_password.
+PRINCIPAL_COLUMNS = [column.key for column in User.__table__.columns if column.key != "hashed_password"]
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+# users.claims_version per user id. A token's role claims are trusted only while its "ver"
+# matches; bumping the version (and publishing it) makes every older token's claims stale.
+claims_versions = TTLCache(PRINCIPAL_CACHE_SIZE, CLAIMS_VERSION_CACHE_TTL)
+metrics.register_gauge("claims_version_cache", claims_versions.stats)
 
 
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
+class TokenClaims(NamedTuple):
+    user_id: int
+    teaching: FrozenSet[int]
+    enrolled: FrozenSet[int]
+
+    def is_teacher(self, subject_id: int) -> bool:
+        return subject_id in self.teaching
+
+    def is_member(self, subject_id: int) -> bool:
+        return subject_id in self.teaching or subject_id in self.enrolled
+
+
+async def run_password_job(func, *args):
+    # bcrypt takes hundreds of milliseconds and releases the GIL, so it runs on a small
+    # dedicated pool instead of blocking the event loop.
+    global password_jobs
+    if password_jobs >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING:
+        metrics.increment("password_hash_rejected")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again",
+            headers={"Retry-After": "1"},
+        )
+
+    password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # Returns a new hash alongside a successful check when the stored one uses outdated settings.
+    return await run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+async def load_hashed_password(db: AsyncSession, user_id: int) -> Optional[str]:
+    result = await db.execute(select(User.hashed_password).where(User.id == user_id))
+    return result.scalar_one_or_none()
+
+
+async def get_password_hash(password: str) -> str:
+    return await run_password_job(pwd_context.hash, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -41,6 +114,95 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def set_access_cookie(response: Response, access_token: str):
+    response.set_cookie(
+        key="access_token",
+        value=f"Bearer {access_token}",
+        httponly=True,
+        max_age=1800,
+        expires=1800,
+        samesite="lax"
+    )
+
+
+async def create_user_token(db: AsyncSession, user: User) -> str:
+    # Embeds the user id and a versioned summary of the user's roles so most permission
+    # checks can be answered from the token alone.
+    result = await db.execute(select(User.claims_version).filter(User.id == user.id))
+    version = result.scalar_one()
+    result = await db.execute(select(Subject.id).filter(Subject.teacher_id == user.id))
+    teaching = result.scalars().all()
+    result = await db.execute(select(Enrollment.subject_id).filter(Enrollment.student_id == user.id))
+    enrolled = result.scalars().all()
+
+    claims_versions.set(user.id, version)
+    return create_access_token(data={
+        "sub": user.email,
+        "uid": user.id,
+        "ver": version,
+        "teach": sorted(set(teaching)),
+        "learn": sorted(set(enrolled))
+    })
+
+
+async def bump_claims_version(db: AsyncSession, user_ids: Iterable[int]):
+    # Runs inside the caller's transaction; call invalidate_claims() after committing.
+    user_ids = list(user_ids)
+    if user_ids:
+        await db.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(claims_version=User.claims_version + 1)
+        )
+
+
+async def invalidate_claims(user_ids: Iterable[int]):
+    for user_id in set(user_ids):
+        await broker.publish("claims", user_id, "")
+
+
+async def _on_invalidate_claims(user_id: int, payload: str):
+    claims_versions.pop(user_id)
+
+
+broker.subscribe("claims", _on_invalidate_claims)
+
+
+async def get_claims_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    version = claims_versions.get(user_id)
+    if version is None:
+        result = await db.execute(select(User.claims_version).filter(User.id == user_id))
+        version = result.scalar_one_or_none()
+        if version is not None:
+            claims_versions.set(user_id, version)
+    return version
+
+
+async def get_token_claims(
+        access_token: Optional[str] = Cookie(None, alias="access_token"),
+        db: AsyncSession = Depends(get_db)
+) -> Optional[TokenClaims]:
+    # None for missing, invalid, pre-claims or stale tokens: callers then check the database.
+    if not access_token:
+        return None
+    try:
+        token = access_token.replace("Bearer ", "") if access_token.startswith("Bearer ") else access_token
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+    user_id = payload.get("uid")
+    if user_id is None:
+        return None
+
+    if await get_claims_version(db, user_id) != payload.get("ver"):
+        metrics.increment("token_claims", "stale")
+        return None
+
+    metrics.increment("token_claims", "fresh")
+    return TokenClaims(user_id, frozenset(payload.get("teach", [])), frozenset(payload.get("learn", [])))
+
+
 async def get_current_user(access_token: Optional[str] = Cookie(None, alias="access_token")):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -85,15 +247,39 @@ async def get_current_user_for_id(
     except JWTError:
         raise credentials_exception
 
+    values = principal_cache.get(email)
+    if values is not None:
+        return User(**values)
+
     result = await db.execute(select(User).filter(User.email == email))
     user = result.scalar_one_or_none()
 
     if not user:
         raise credentials_exception
 
+    principal_cache.set(email, {key: getattr(user, key) for key in PRINCIPAL_COLUMNS})
     return user
 
 
+async def get_admin_user(current_user: User = Depends(get_current_user_for_id)) -> User:
+    # Operational snapshots include user ids and code locations, so they are admin-only.
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    return current_user
+
+
+async def invalidate_principal(email: str):
+    # Published so every worker drops the cached user, not just the one that handled the change.
+    await broker.publish("principals", email, "")
+
+
+async def _on_invalidate_principal(email: str, payload: str):
+    principal_cache.pop(email)
+
+
+broker.subscribe("principals", _on_invalidate_principal)
+
+
 async def get_current_user_optional(access_token: str | None = Cookie(None, alias="access_token")):
     if not access_token:
         return None
@@ -1,20 +1,56 @@
+// How many recently shown notification ids are remembered for de-duplication.
+const SEEN_IDS_LIMIT = 500;
+
 class NotificationManager {
     constructor() {
         this.socket = null;
-        this.userId = document.getElementById('user-id').value;
+        this.stream = null;
+        const userIdInput = document.getElementById('user-id');
+        this.userId = userIdInput ? userIdInput.value : 'me';
+        // Highest notification id shown so far; the server replays unread ones above it on connect.
+        this.cursorKey = `notifications:last_id:${this.userId}`;
+        this.lastId = parseInt(localStorage.getItem(this.cursorKey) || '0', 10);
+        // Ids from different dispatcher batches (or a replay racing a live push) can arrive out
+        // of order, so duplicates are recognised by id rather than by comparing with lastId.
+        this.seenIds = new Set();
     }
 
     connect() {
-        this.socket = new WebSocket(`ws://127.0.0.1:8000/notifications/ws/${this.userId}`);
+        // Notifications only flow server -> client, so a plain HTTP event stream is enough;
+        // the websocket remains as a fallback.
+        if (window.EventSource) {
+            this.connectStream();
+        } else {
+            this.connectWebSocket();
+        }
+    }
+
+    connectStream() {
+        // EventSource reconnects on its own and resumes from the last event id it saw.
+        this.stream = new EventSource(`/notifications/stream?since=${this.lastId}`);
+        this.stream.onmessage = (event) => this.handleMessage(JSON.parse(event.data));
+        this.stream.onerror = () => {
+            console.log("Notification stream interrupted, retrying");
+        };
+    }
+
+    connectWebSocket() {
+        // Same host as the page, so the access-token cookie is sent with the handshake.
+        const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+        this.socket = new WebSocket(`${protocol}://${location.host}/notifications/ws?since=${this.lastId}`);
         
         this.socket.onmessage = (event) => {
             const message = JSON.parse(event.data);
-            this.showNotification(message);
+            if (message.type === 'ping') {
+                this.socket.send(JSON.stringify({ type: 'pong' }));
+                return;
+            }
+            this.handleMessage(message);
         };
 
         this.socket.onclose = () => {
             console.log("WebSocket connection closed!");
-            setTimeout(() => this.connect(), 1000);
+            setTimeout(() => this.connectWebSocket(), 1000);
         };
 
         this.socket.onopen = () => {
@@ -22,17 +58,42 @@ class NotificationManager {
         };
     }
 
+    handleMessage(message) {
+        if (this.seenIds.has(message.id)) {
+            return;
+        }
+        this.seenIds.add(message.id);
+        if (this.seenIds.size > SEEN_IDS_LIMIT) {
+            this.seenIds.delete(this.seenIds.values().next().value);
+        }
+        this.lastId = Math.max(this.lastId, message.id);
+        localStorage.setItem(this.cursorKey, String(this.lastId));
+        this.showNotification(message);
+    }
+
     showNotification(message) {
+        // Built from DOM nodes: content includes user-supplied course/task titles and usernames.
         const notification = document.createElement('div');
         notification.className = 'toast';
-        notification.innerHTML = `
-            <div class="toast-header">
-                <strong class="me-auto">Message from ${message.person_from}</strong>
-                <small>${message.text.time_sent}</small>
-                <button type="button" class="btn-close" data-bs-dismiss="toast"></button>
-            </div>
-            <div class="toast-body">${message.text}</div>
-        `;
+
+        const header = document.createElement('div');
+        header.className = 'toast-header';
+        const title = document.createElement('strong');
+        title.className = 'me-auto';
+        title.textContent = `Message from ${message.person_from}`;
+        const time = document.createElement('small');
+        time.textContent = message.text.time_sent;
+        const close = document.createElement('button');
+        close.type = 'button';
+        close.className = 'btn-close';
+        close.dataset.bsDismiss = 'toast';
+        header.append(title, time, close);
+
+        const body = document.createElement('div');
+        body.className = 'toast-body';
+        body.textContent = message.content;
+
+        notification.append(header, body);
         
         document.getElementById('notifications-container').appendChild(notification);
         const toast = new bootstrap.Toast(notification, {
@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+import pytest
+
+# Tests that take the pg_engine fixture need a disposable Postgres database, e.g.
+# TEST_DATABASE_URL=postgresql://postgres@localhost/module3_test. Its schema is recreated.
+# The database stack is imported inside the fixtures so the pure unit tests run without it.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+    from models import Base
+    from partitions import ensure_partitions
+
+    # NullPool: every run() gets its own event loop, so connections cannot be shared between them.
+    engine = create_async_engine(
+        TEST_DATABASE_URL.split("?")[0].replace("postgresql://", "postgresql+asyncpg://"),
+        poolclass=NullPool
+    )
+
+    async def create_schema():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            await ensure_partitions(conn)
+
+    run(create_schema())
+    return engine
+
+
+@pytest.fixture
+def session_factory(pg_engine):
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import sessionmaker
+
+    return sessionmaker(bind=pg_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine.sync_engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_statements(pg_engine):
+    return lambda: StatementCounter(pg_engine)
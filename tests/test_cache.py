@@ -0,0 +1,63 @@
+import pytest
+
+from cache import MISSING, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_get_returns_default_for_missing_key(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("absent") is None
+    assert cache.get("absent", MISSING) is MISSING
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("key", "value")
+
+    clock[0] += 59
+    assert cache.get("key") == "value"
+
+    clock[0] += 2
+    assert cache.get("key") is None
+    assert "key" not in cache.entries
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_pop_and_clear(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    cache.pop("a")
+    cache.pop("never-set")
+    assert cache.get("a") is None
+
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_stats_report_hit_rate(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 1, "hit_rate": 0.6667}
@@ -0,0 +1,53 @@
+import pytest
+
+rate_limit = pytest.importorskip("rate_limit")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("rate_limit.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = rate_limit.TokenBucket(rate=2, capacity=4)
+    for _ in range(4):
+        assert bucket.retry_after() == 0
+        bucket.consume()
+    assert bucket.retry_after() == pytest.approx(0.5)
+
+    clock[0] += 1
+    bucket.refill(clock[0])
+    assert bucket.tokens == pytest.approx(2)
+
+    clock[0] += 60
+    bucket.refill(clock[0])
+    assert bucket.tokens == 4
+
+
+def test_bucket_set_evicts_least_recently_used(clock):
+    buckets = rate_limit.BucketSet(rate=1, capacity=1, maxsize=2)
+    first = buckets.get("a", clock[0])
+    buckets.get("b", clock[0])
+    buckets.get("a", clock[0])
+    buckets.get("c", clock[0])
+
+    assert list(buckets.buckets) == ["a", "c"]
+    assert buckets.get("a", clock[0]) is first
+
+
+def test_chat_limiter_rejects_without_spending_tokens(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "CHAT_USER_RATE", 1)
+    monkeypatch.setattr(rate_limit, "CHAT_USER_BURST", 2)
+    limiter = rate_limit.ChatRateLimiter()
+
+    assert limiter.acquire(1, "room") == 0
+    assert limiter.acquire(1, "room") == 0
+    assert limiter.acquire(1, "room") == pytest.approx(1)
+    # Other senders in the same room are unaffected.
+    assert limiter.acquire(2, "room") == 0
+
+    clock[0] += 1
+    assert limiter.acquire(1, "room") == 0
+    assert limiter.throttled_senders_stats()["top"] == {"1": 1}
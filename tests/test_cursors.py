@@ -0,0 +1,18 @@
+import datetime
+
+import pytest
+
+chats = pytest.importorskip("routes.chats")
+from fastapi import HTTPException
+
+
+def test_history_cursor_round_trips():
+    created_at = datetime.datetime(2026, 3, 1, 12, 30, 15, 123456)
+    assert chats.decode_cursor(chats.encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bm8tc2VwYXJhdG9y", "MjAyNi0wMy0wMXx4"])
+def test_malformed_cursors_are_rejected_with_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        chats.decode_cursor(cursor)
+    assert error.value.status_code == 400
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from tests.conftest import run
+
+message_writer = pytest.importorskip("message_writer")
+
+
+def test_submit_fails_when_the_writer_is_not_running():
+    writer = message_writer.MessageWriter()
+    with pytest.raises(RuntimeError):
+        run(writer.submit(object(), {}))
+
+
+def test_submit_fails_after_the_writer_task_died():
+    async def scenario():
+        writer = message_writer.MessageWriter()
+        writer.task = asyncio.create_task(asyncio.sleep(0))
+        await writer.task
+        await writer.submit(object(), {})
+
+    with pytest.raises(RuntimeError):
+        run(scenario())
+
+
+def test_submit_times_out_when_the_batch_never_commits(monkeypatch):
+    async def stalled_insert(self, batch):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(message_writer.MessageWriter, "_insert", stalled_insert)
+
+    async def scenario():
+        writer = message_writer.MessageWriter(flush_interval=0)
+        await writer.start()
+        try:
+            await writer.submit(object(), {}, timeout=0.05)
+        finally:
+            writer.task.cancel()
+
+    with pytest.raises(asyncio.TimeoutError):
+        run(scenario())
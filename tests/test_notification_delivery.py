@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+import pytest
+
+from tests.conftest import run
+
+notifications = pytest.importorskip("routes.notifications")
+from realtime import WS_RESYNC_CLOSE_CODE
+
+
+class StalledWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, payload):
+        await self.release.wait()
+        self.sent.append(payload)
+
+    async def close(self, code=None, reason=None):
+        self.closed_with = code
+
+
+def test_deliver_does_not_wait_for_a_stalled_socket():
+    async def scenario():
+        manager = notifications.ConnectionManager("test_notifications")
+        stalled, healthy = StalledWebSocket(), StalledWebSocket()
+        healthy.release.set()
+        await manager.connect(stalled, "1")
+        await manager.connect(healthy, "2")
+
+        batch = json.dumps({
+            "to": [[10, "1"], [11, "2"]],
+            "message": {"id": 0, "person_to": "", "text": {"id": 0}}
+        })
+        await asyncio.wait_for(manager.deliver(notifications.BATCH_KEY, batch), 0.1)
+        await asyncio.sleep(0)
+        return stalled, healthy
+
+    stalled, healthy = run(scenario())
+    assert stalled.sent == []
+    assert [json.loads(payload)["id"] for payload in healthy.sent] == [11]
+
+
+def test_full_queue_evicts_the_connection(monkeypatch):
+    monkeypatch.setattr(notifications.NotificationConnection, "queue_size", 2)
+
+    async def scenario():
+        manager = notifications.ConnectionManager("test_notifications")
+        websocket = StalledWebSocket()
+        connection = await manager.connect(websocket, "1")
+        for notification_id in range(4):
+            await manager.deliver("1", json.dumps({"id": notification_id}))
+        await asyncio.sleep(0)
+        return manager, connection, websocket
+
+    manager, connection, websocket = run(scenario())
+    assert connection.closed
+    assert "1" not in manager.active_connections
+    assert websocket.closed_with == WS_RESYNC_CLOSE_CODE
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+
+from tests.conftest import run
+
+partitions = pytest.importorskip("partitions")
+from sqlalchemy import text
+
+
+@pytest.mark.parametrize("value, months, expected", [
+    (datetime(2026, 1, 15), 1, datetime(2026, 2, 1)),
+    (datetime(2026, 12, 31), 1, datetime(2027, 1, 1)),
+    (datetime(2026, 1, 1), -1, datetime(2025, 12, 1)),
+    (datetime(2026, 3, 9), -14, datetime(2025, 1, 1)),
+    (datetime(2026, 3, 9), 0, datetime(2026, 3, 1)),
+])
+def test_add_months_lands_on_first_of_month(value, months, expected):
+    assert partitions.add_months(value, months) == expected
+
+
+def test_partition_name_and_bounds():
+    month = datetime(2026, 12, 1)
+    assert partitions.partition_name("messages", month) == "messages_p202612"
+    assert partitions.partition_bounds(month) == "FROM ('2026-12-01') TO ('2027-01-01')"
+    assert partitions.PARTITION_NAME.search("messages_p202612").groups() == ("2026", "12")
+
+
+def test_rows_without_a_month_partition_land_in_default_and_are_split_out(pg_engine):
+    # Far enough ahead that no premade partition covers it.
+    month = partitions.add_months(partitions.month_start(datetime.utcnow()), 60)
+
+    async def scenario():
+        async with pg_engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO private_messages (content, created_at) VALUES ('from the future', :created_at)"
+            ), {"created_at": month})
+            in_default = await conn.execute(text("SELECT count(*) FROM private_messages_default"))
+            assert in_default.scalar() == 1
+
+            await partitions.ensure_partitions(conn)
+            in_default = await conn.execute(text("SELECT count(*) FROM private_messages_default"))
+            in_month = await conn.execute(text(f"SELECT content FROM {partitions.partition_name('private_messages', month)}"))
+            return in_default.scalar(), in_month.scalars().all()
+
+    assert run(scenario()) == (0, ["from the future"])
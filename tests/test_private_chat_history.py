@@ -0,0 +1,58 @@
+import datetime
+import uuid
+
+from tests.conftest import run
+
+
+async def seed_private_chat(session_factory, message_count: int):
+    from models import PrivateChat, PrivateMessage, User
+
+    suffix = uuid.uuid4().hex[:8]
+    async with session_factory() as session:
+        users = [User(email=f"{name}-{suffix}@example.com", username=f"{name}-{suffix}", hashed_password="x")
+                 for name in ("alice", "bob")]
+        session.add_all(users)
+        await session.flush()
+        alice, bob = sorted(users, key=lambda user: user.id)
+        chat = PrivateChat(user1_id=alice.id, user2_id=bob.id)
+        session.add(chat)
+        await session.flush()
+
+        now = datetime.datetime.utcnow()
+        session.add_all([
+            PrivateMessage(
+                chat_id=chat.id,
+                sender_id=(alice, bob)[i % 2].id,
+                content=f"message {i}",
+                created_at=now - datetime.timedelta(seconds=message_count - i)
+            )
+            for i in range(message_count)
+        ])
+        await session.commit()
+        return alice, bob
+
+
+def history_statement_count(session_factory, count_statements, message_count: int) -> int:
+    from routes.chats import get_private_chat_messages
+
+    async def scenario():
+        alice, bob = await seed_private_chat(session_factory, message_count)
+        async with session_factory() as session:
+            with count_statements() as counter:
+                page = await get_private_chat_messages(
+                    username=bob.username, before=None, after=None, limit=200, db=session, token=alice
+                )
+        assert len(page["messages"]) == message_count
+        assert all(message["username"] in (alice.username, bob.username) for message in page["messages"])
+        return counter.count
+
+    return run(scenario())
+
+
+def test_private_history_query_count_does_not_grow_with_messages(session_factory, count_statements):
+    short = history_statement_count(session_factory, count_statements, 3)
+    long = history_statement_count(session_factory, count_statements, 150)
+
+    assert long == short
+    # Recipient lookup, chat resolution, then the hot and archive history pages.
+    assert short <= 5
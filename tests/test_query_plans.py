@@ -0,0 +1,170 @@
+import json
+import re
+
+import pytest
+
+from tests.conftest import run
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+from sqlalchemy import Integer, bindparam, func, select, text, tuple_
+from sqlalchemy.dialects import postgresql
+
+from models import Chat, ChatParticipant, Enrollment, Grade, Message, Subject, Task, TaskUpload
+
+# A sequential scan in a hot query is a regression on any table (or partition) at least this big.
+LARGE_TABLE_ROWS = 1000
+USERS = 5000
+SUBJECTS = 1000
+STUDENTS_PER_SUBJECT = 50
+TASKS_PER_SUBJECT = 20
+UPLOADS_PER_TASK = 5
+MESSAGES = 50000
+
+# Every range is offset from the first id seeded into its table, so rows written by other
+# tests on the same database do not matter.
+SEED = [
+    ("users", """
+        INSERT INTO users (email, username, hashed_password)
+        SELECT 'plan-seed-' || i || '@example.com', 'plan-seed-' || i, 'x'
+        FROM generate_series(1, :users) i
+    """),
+    ("subjects", """
+        INSERT INTO subjects (title, teacher_id, access_code)
+        SELECT 'plan-seed ' || i, :users_base + i % :users, 'plan-' || i
+        FROM generate_series(1, :subjects) i
+    """),
+    ("enrollments", """
+        INSERT INTO enrollments (student_id, subject_id)
+        SELECT :users_base + (s * 7 + k) % :users, :subjects_base + s
+        FROM generate_series(0, :subjects - 1) s, generate_series(1, :students) k
+    """),
+    ("chats", """
+        INSERT INTO chats (name, is_group, subject_id)
+        SELECT 'plan-seed ' || s, TRUE, :subjects_base + s
+        FROM generate_series(0, :subjects - 1) s
+    """),
+    ("chat_participants", """
+        INSERT INTO chat_participants (chat_id, user_id)
+        SELECT :chats_base + s, :users_base + (s * 7 + k) % :users
+        FROM generate_series(0, :subjects - 1) s, generate_series(1, :students) k
+    """),
+    ("tasks", """
+        INSERT INTO tasks (title, subject_id, deadline, max_grade)
+        SELECT 'task ' || k, :subjects_base + s, now() + k * interval '1 day', 12
+        FROM generate_series(0, :subjects - 1) s, generate_series(1, :tasks) k
+    """),
+    ("task_uploads", """
+        INSERT INTO task_uploads (task_id, student_id, content, status)
+        SELECT :tasks_base + t, :users_base + (t * 3 + k) % :users, 'answer', 'uploaded'
+        FROM generate_series(0, :subjects * :tasks - 1) t, generate_series(1, :uploads) k
+    """),
+    ("grades", """
+        INSERT INTO grades (task_upload_id, grade)
+        SELECT id, 10 FROM task_uploads WHERE id >= :task_uploads_base
+    """),
+    ("messages", """
+        INSERT INTO messages (chat_id, sender_id, content, created_at)
+        SELECT :chats_base + i % :subjects, :users_base + i % :users, 'message ' || i,
+               date_trunc('month', now() AT TIME ZONE 'utc') + i * interval '1 second'
+        FROM generate_series(1, :messages) i
+    """),
+]
+
+
+def seed_statement(statement: str):
+    # asyncpg cannot infer a type for a bare parameter in arithmetic (unknown * unknown).
+    names = sorted(set(re.findall(r"(?<!:):(\w+)", statement)))
+    return text(statement).bindparams(*(bindparam(name, type_=Integer) for name in names))
+
+
+@pytest.fixture(scope="module")
+def seeded(pg_engine):
+    params = {
+        "users": USERS, "subjects": SUBJECTS, "students": STUDENTS_PER_SUBJECT,
+        "tasks": TASKS_PER_SUBJECT, "uploads": UPLOADS_PER_TASK, "messages": MESSAGES
+    }
+
+    async def seed():
+        async with pg_engine.begin() as conn:
+            for table, statement in SEED:
+                start = await conn.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}"))
+                params[f"{table}_base"] = start.scalar()
+                await conn.execute(seed_statement(statement), params)
+            await conn.execute(text("ANALYZE"))
+            result = await conn.execute(
+                text("SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples >= :rows"),
+                {"rows": LARGE_TABLE_ROWS}
+            )
+            params["large_tables"] = set(result.scalars().all())
+
+    run(seed())
+    return params
+
+
+def hot_queries(ids):
+    subject_id = ids["subjects_base"] + 17
+    student_id = ids["users_base"] + 42
+    chat_id = ids["chats_base"] + 17
+    task_id = ids["tasks_base"] + 17
+    upload_id = ids["task_uploads_base"] + 17
+    return {
+        "subject members": select(Subject.teacher_id, Enrollment.student_id)
+            .outerjoin(Enrollment, Enrollment.subject_id == Subject.id)
+            .filter(Subject.id == subject_id),
+        "enrollment check": select(Enrollment)
+            .filter(Enrollment.student_id == student_id, Enrollment.subject_id == subject_id),
+        "enrolled subjects": select(Enrollment.subject_id).where(Enrollment.student_id == student_id),
+        "subject tasks by deadline": select(Task)
+            .filter(Task.subject_id == subject_id, Task.deadline >= func.now())
+            .order_by(Task.deadline),
+        "student upload": select(TaskUpload)
+            .filter(TaskUpload.task_id == task_id, TaskUpload.student_id == student_id),
+        "task uploads": select(TaskUpload).filter(TaskUpload.task_id == task_id),
+        "upload grade": select(Grade).where(Grade.task_upload_id == upload_id),
+        "subject chat": select(Chat).filter(Chat.subject_id == subject_id),
+        "chat participant": select(ChatParticipant)
+            .filter(ChatParticipant.chat_id == chat_id, ChatParticipant.user_id == student_id),
+        "chat subject": select(Chat.subject_id).filter(Chat.id == chat_id),
+        "history page": select(Message)
+            .filter(Message.chat_id == chat_id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(51),
+        "history page before cursor": select(Message)
+            .filter(
+                Message.chat_id == chat_id,
+                tuple_(Message.created_at, Message.id) < tuple_(func.now(), 2 ** 31 - 1)
+            )
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(51),
+    }
+
+
+def sequential_scans(plan: dict, large_tables):
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in large_tables:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from sequential_scans(child, large_tables)
+
+
+def explain(pg_engine, statement) -> dict:
+    sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+
+    async def query():
+        async with pg_engine.connect() as conn:
+            result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            return result.scalar()
+
+    output = run(query())
+    if isinstance(output, str):
+        output = json.loads(output)
+    return output[0]["Plan"]
+
+
+@pytest.mark.parametrize("name", [
+    "subject members", "enrollment check", "enrolled subjects", "subject tasks by deadline",
+    "student upload", "task uploads", "upload grade", "subject chat", "chat participant",
+    "chat subject", "history page", "history page before cursor",
+])
+def test_hot_query_does_not_scan_large_tables(pg_engine, seeded, name):
+    plan = explain(pg_engine, hot_queries(seeded)[name])
+    assert list(sequential_scans(plan, seeded["large_tables"])) == [], json.dumps(plan, indent=2)
@@ -0,0 +1,60 @@
+import pytest
+
+from tests.conftest import run
+
+rate_limit = pytest.importorskip("rate_limit")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("rate_limit.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_local_window_rejects_after_limit_failures_then_frees_up(clock):
+    backend = rate_limit.LocalWindowBackend()
+
+    for _ in range(3):
+        assert run(backend.retry_after("ip:1", limit=3, window=60)) == 0
+        run(backend.record(["ip:1"], window=60))
+    clock[0] += 10
+    assert run(backend.retry_after("ip:1", limit=3, window=60)) == pytest.approx(50)
+    clock[0] += 50
+    assert run(backend.retry_after("ip:1", limit=3, window=60)) == 0
+
+
+def test_local_window_keys_are_independent_and_clearable(clock):
+    backend = rate_limit.LocalWindowBackend()
+    run(backend.record(["email:a"], window=60))
+    assert run(backend.retry_after("email:a", limit=1, window=60)) > 0
+    assert run(backend.retry_after("email:b", limit=1, window=60)) == 0
+
+    run(backend.clear("email:a"))
+    assert run(backend.retry_after("email:a", limit=1, window=60)) == 0
+
+
+def test_login_limiter_counts_failures_per_normalised_email(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "LOGIN_IP_LIMIT", 100)
+    monkeypatch.setattr(rate_limit, "LOGIN_EMAIL_LIMIT", 2)
+    limiter = rate_limit.LoginLimiter()
+
+    run(limiter.record_failure("10.0.0.1", "User@Example.com"))
+    run(limiter.record_failure("10.0.0.2", " user@example.com"))
+    assert run(limiter.check("10.0.0.3", "USER@example.com")) > 0
+    assert run(limiter.check("10.0.0.3", "other@example.com")) == 0
+
+
+def test_login_limiter_ignores_successes_and_resets_on_success(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "LOGIN_IP_LIMIT", 2)
+    monkeypatch.setattr(rate_limit, "LOGIN_EMAIL_LIMIT", 2)
+    limiter = rate_limit.LoginLimiter()
+
+    # Checks alone (successful logins, rejected attempts) never fill a window.
+    for _ in range(5):
+        assert run(limiter.check("10.0.0.1", "user@example.com")) == 0
+
+    run(limiter.record_failure("10.0.0.1", "user@example.com"))
+    run(limiter.record_success("user@example.com"))
+    run(limiter.record_failure("10.0.0.2", "user@example.com"))
+    assert run(limiter.check("10.0.0.3", "user@example.com")) == 0
@@ -0,0 +1,40 @@
+import pytest
+
+database = pytest.importorskip("database")
+
+
+@pytest.fixture
+def factories(monkeypatch):
+    monkeypatch.setattr(database, "AsyncSessionLocal", lambda: "primary")
+    monkeypatch.setattr(database, "ReadSessionLocal", lambda: "replica")
+
+
+@pytest.fixture
+def pin():
+    pin = {"pinned": False, "wrote": False}
+    token = database.read_pin.set(pin)
+    yield pin
+    database.read_pin.reset(token)
+
+
+def test_reads_go_to_the_replica_by_default(factories, pin):
+    assert database.read_session_factory() == "replica"
+
+
+def test_reads_follow_the_pin_cookie(factories, pin):
+    pin["pinned"] = True
+    assert database.read_session_factory() == "primary"
+
+
+def test_read_session_opened_after_a_commit_uses_the_primary(factories, pin):
+    session = database.LazySession(database.read_session_factory)
+    # The dependency has resolved, but nothing has been opened yet when the handler commits.
+    database._pin_reads_to_primary(None)
+    assert pin["wrote"]
+
+    session.startswith  # first use opens the session
+    assert session._session == "primary"
+
+
+def test_outside_a_request_reads_go_to_the_replica(factories):
+    assert database.read_session_factory() == "replica"
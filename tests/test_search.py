@@ -0,0 +1,13 @@
+import pytest
+
+chats = pytest.importorskip("routes.chats")
+
+
+def test_search_cursor_round_trips_rank_exactly():
+    rank = 0.060792710632085800
+    assert chats.decode_search_cursor(chats.encode_search_cursor(rank, 7)) == (rank, 7)
+
+
+def test_search_snippet_is_escaped_before_highlighting():
+    snippet = f"<b>{chats.SEARCH_MATCH_START}hi{chats.SEARCH_MATCH_STOP}</b>"
+    assert chats.highlight_snippet(snippet) == "&lt;b&gt;<mark>hi</mark>&lt;/b&gt;"